@@ -0,0 +1,84 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Encoding throughput of reading events, per-reading json.dumps(getService(...)) versus the
+# batched template encoder, including construction of the cc_lib event envelopes:
+#
+#     python -m benchmark.encoding --responses 100000
+
+
+from benchmark import fake_cc_lib
+from benchmark.run import prepareWorkdir
+from tempfile import mkdtemp
+from os import chdir
+import argparse, json, time, random, shutil
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Events encoded per second before and after the batched encoder.")
+    parser.add_argument("--responses", type=int, default=100000, help="number of simulated poll responses")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fake_cc_lib.install()
+    root = mkdtemp(prefix="blebox-encoding-")
+    try:
+        prepareWorkdir(root, "encoding")
+        from blebox.device import BleboxAirSensor
+        import cc_lib
+
+        rand = random.Random(0)
+        device = BleboxAirSensor("sim000000", "Simulated sim000000", "127.1.0.1")
+        responses = [
+            {"air": {"sensors": [{"type": s_type, "value": rand.randint(0, 120)} for s_type in ("pm1", "pm2.5", "pm10")]}}
+            for _ in range(args.responses)
+        ]
+        Message = cc_lib.client.message.Message
+        EventEnvelope = cc_lib.client.message.EventEnvelope
+
+        def legacy():
+            for air_state in responses:
+                for sensor in air_state['air']['sensors']:
+                    service = "reading_{}".format(sensor['type'])
+                    EventEnvelope(device.id, service, Message(json.dumps(device.getService(service, sensor['value']))))
+
+        def batched():
+            for air_state in responses:
+                readings = [("reading_{}".format(sensor['type']), sensor['value'], None) for sensor in air_state['air']['sensors']]
+                for service, data in device.encodeReadings(readings):
+                    EventEnvelope(device.id, service, Message(data))
+
+        sensor = responses[0]['air']['sensors'][0]
+        expected = json.loads(json.dumps(device.getService("reading_pm1", sensor['value'])))
+        encoded = json.loads(device.encodeReadings([("reading_pm1", sensor['value'], None)])[0][1])
+        expected.pop("time"), encoded.pop("time")
+        assert expected == encoded, "encoders disagree"
+
+        events = args.responses * 3
+        for name, func in (("per reading", legacy), ("batched", batched)):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            print("{:<12} {:>12.1f} events/s".format(name, events / best), flush=True)
+    finally:
+        chdir("/")
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('install', 'FakeClient')
+
+
+from types import ModuleType
+from threading import Lock
+import sys, logging
+
+
+class Future:
+    """Already completed future mimicking the subset of cc_lib's future API used by the connector."""
+
+    __slots__ = ('__result', '__error')
+
+    def __init__(self, result=None, error: Exception = None):
+        self.__result = result
+        self.__error = error
+
+    def done(self) -> bool:
+        return True
+
+    def wait(self, timeout=None) -> None:
+        pass
+
+    def result(self):
+        if self.__error:
+            raise self.__error
+        return self.__result
+
+
+class Device:
+    services = tuple()
+
+    def getService(self, service):
+        for srv in self.services:
+            if srv.local_id == service:
+                return srv
+        raise KeyError(service)
+
+
+class Service:
+    local_id = None
+
+
+class Message:
+
+    def __init__(self, data: str, metadata=None):
+        self.data = data
+        self.metadata = metadata
+
+
+class EventEnvelope:
+
+    def __init__(self, device, service, message: Message):
+        self.device_id = device if isinstance(device, str) else device.id
+        self.service_uri = service if isinstance(service, str) else service.local_id
+        self.message = message
+
+
+class FakeClient:
+    """Stand-in for cc_lib.client.Client which acknowledges every call and counts emitted events."""
+
+    def __init__(self, *args, **kwargs):
+        self.__lock = Lock()
+        self.events = 0
+        self.hub_syncs = 0
+        self.connect_clbk = None
+        self.disconnect_clbk = None
+
+    def setConnectClbk(self, func):
+        self.connect_clbk = func
+
+    def setDisconnectClbk(self, func):
+        self.disconnect_clbk = func
+
+    def initHub(self, *args, **kwargs):
+        pass
+
+    def connect(self, *args, **kwargs):
+        if self.connect_clbk:
+            self.connect_clbk(self)
+
+    def addDevice(self, device, asynchronous=False):
+        return Future(device)
+
+    def updateDevice(self, device, asynchronous=False):
+        return Future(device)
+
+    def deleteDevice(self, device, asynchronous=False):
+        return Future(device)
+
+    def connectDevice(self, device, asynchronous=False):
+        return Future(device)
+
+    def disconnectDevice(self, device, asynchronous=False):
+        return Future(device)
+
+    def syncHub(self, devices, asynchronous=False):
+        with self.__lock:
+            self.hub_syncs += 1
+        return Future(devices)
+
+    def emmitEvent(self, envelope, asynchronous=False):
+        with self.__lock:
+            self.events += 1
+        return Future(envelope)
+
+
+def install() -> None:
+    """Register a fake 'cc_lib' package in sys.modules. Must be called before importing 'blebox'."""
+    cc_lib = ModuleType("cc_lib")
+    types = ModuleType("cc_lib.types")
+    client = ModuleType("cc_lib.client")
+    message = ModuleType("cc_lib.client.message")
+    logger = ModuleType("cc_lib.logger")
+    types.Device = Device
+    types.Service = Service
+    message.Message = Message
+    message.EventEnvelope = EventEnvelope
+    client.Client = FakeClient
+    client.message = message
+    for error in ('DeviceConnectError', 'DeviceDisconnectError', 'NotConnectedError', 'DeviceAddError', 'DeviceUpdateError', 'HubError', 'HubInitializationError', 'EventEmitError'):
+        setattr(client, error, type(error, (Exception, ), dict()))
+    logger.getLogger = logging.getLogger
+    cc_lib.types = types
+    cc_lib.client = client
+    cc_lib.logger = logger
+    sys.modules.update({
+        "cc_lib": cc_lib,
+        "cc_lib.types": types,
+        "cc_lib.client": client,
+        "cc_lib.client.message": message,
+        "cc_lib.logger": logger
+    })
@@ -0,0 +1,141 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('SimulatedFleet', )
+
+
+from ipaddress import IPv4Network
+from threading import Thread, Event
+from math import ceil, log2
+import asyncio, json, random
+
+
+DEVICE_PATH = "api/device/state"
+STATE_PATH = "api/air/state"
+
+
+class SimulatedFleet(Thread):
+    """
+    Emulates 'size' BleBox air sensors on loopback addresses starting at 'base'. A single listener
+    bound to all addresses answers for every virtual device; the device is picked by the address the
+    connection was made to. 'latency' delays every response, 'failure_rate' answers a share of
+    requests with HTTP 500 and 'hang_rate' never answers a share of requests.
+    """
+
+    def __init__(self, size: int, port: int = 18080, base: str = "127.1.0.0", latency: float = 0.0, failure_rate: float = 0.0, hang_rate: float = 0.0, seed: int = 0):
+        super().__init__(name="simulatedFleet", daemon=True)
+        prefix = 32 - max(1, ceil(log2(size + 2)))
+        self.network = IPv4Network("{}/{}".format(base, prefix), strict=False)
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.requests = 0
+        self.__random = random.Random(seed)
+        self.__devices = dict()
+        for index, address in zip(range(size), self.network.hosts()):
+            self.__devices[str(address)] = "sim{:06d}".format(index)
+        self.__ready = Event()
+        self.__loop = None
+
+    @property
+    def addresses(self) -> list:
+        return list(self.__devices)
+
+    def __deviceInfo(self, ip: str) -> dict:
+        device_id = self.__devices[ip]
+        return {
+            "device": {
+                "deviceName": "Simulated {}".format(device_id),
+                "type": "airSensor",
+                "id": device_id,
+                "ip": ip
+            }
+        }
+
+    def __airState(self) -> dict:
+        return {
+            "air": {
+                "sensors": [
+                    {"type": "pm1", "value": self.__random.randint(0, 50)},
+                    {"type": "pm2.5", "value": self.__random.randint(0, 80)},
+                    {"type": "pm10", "value": self.__random.randint(0, 120)}
+                ]
+            }
+        }
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ip = writer.get_extra_info("sockname")[0]
+        if ip not in self.__devices:
+            writer.close()
+            return
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.requests += 1
+                path = request_line.split()[1].decode().lstrip("/") if len(request_line.split()) > 1 else str()
+                if self.hang_rate and self.__random.random() < self.hang_rate:
+                    await asyncio.sleep(3600)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status = "200 OK"
+                if self.failure_rate and self.__random.random() < self.failure_rate:
+                    status, body = "500 Internal Server Error", b"{}"
+                elif path == DEVICE_PATH:
+                    body = json.dumps(self.__deviceInfo(ip)).encode()
+                elif path == STATE_PATH:
+                    body = json.dumps(self.__airState()).encode()
+                else:
+                    status, body = "404 Not Found", b"{}"
+                writer.write(
+                    "HTTP/1.1 {}\r\nServer: blebox\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n".format(
+                        status, len(body)
+                    ).encode() + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def __serve(self):
+        server = await asyncio.start_server(self.__handle, host="0.0.0.0", port=self.port, backlog=4096, reuse_address=True)
+        self.__ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        self.__loop = asyncio.new_event_loop()
+        try:
+            self.__loop.run_until_complete(self.__serve())
+        except (RuntimeError, asyncio.CancelledError):
+            pass
+
+    def start(self):
+        super().start()
+        self.__ready.wait()
+
+    def __cancelAll(self):
+        for task in asyncio.all_tasks(self.__loop):
+            task.cancel()
+
+    def stop(self):
+        if self.__loop:
+            self.__loop.call_soon_threadsafe(self.__cancelAll)
@@ -0,0 +1,159 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Micro-benchmarks of Monitor._diff/_evaluate and DeviceManager at large fleet sizes:
+#
+#     python -m benchmark.micro --sizes 1000 10000 100000 --history benchmark_history.json
+#
+# Every run is appended to the history file. A benchmark that got slower than the median of the
+# previous runs by more than --threshold makes the run fail with exit code 1.
+
+
+from benchmark import fake_cc_lib
+from benchmark.run import prepareWorkdir
+from tempfile import mkdtemp
+from statistics import median
+from os import chdir, path
+import argparse, json, time, random, shutil, sys, platform
+
+
+def measure(func, repeat: int) -> float:
+    """Best wall time of 'repeat' runs of 'func' in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmarkFleet(size: int, repeat: int) -> dict:
+    from blebox import DeviceManager, Monitor
+    from blebox.device import BleboxAirSensor
+    import cc_lib
+
+    results = dict()
+    device_ids = ["dev{:07d}".format(index) for index in range(size)]
+
+    device_manager = DeviceManager()
+    device_manager.clear()
+    device_manager.addMany((BleboxAirSensor(device_id, "name", "10.0.0.1"), "airSensor") for device_id in device_ids)
+    device_manager.flush()
+    batch = [0]
+
+    def add():
+        batch[0] += 1
+        for index in range(1000):
+            device_manager.add(BleboxAirSensor("new{}-{}".format(batch[0], index), "name", "10.0.0.1"), "airSensor")
+        device_manager.flush()
+
+    results["device_manager.add[1k]"] = measure(add, repeat)
+    for index in range(1000):
+        for run in range(1, batch[0] + 1):
+            device_manager.delete("new{}-{}".format(run, index))
+    device_manager.flush()
+    sample = random.Random(0).choices(device_ids, k=min(size, 10000))
+    label = "{}k".format(len(sample) // 1000) if len(sample) % 1000 == 0 else len(sample)
+
+    def get():
+        for device_id in sample:
+            device_manager.get(device_id)
+
+    results["device_manager.get[{}]".format(label)] = measure(get, repeat)
+
+    def update():
+        for device_id in sample:
+            device_manager.update(device_manager.get(device_id))
+        device_manager.flush()
+
+    results["device_manager.update[{}]".format(label)] = measure(update, repeat)
+
+    for device in device_manager.devices.values():
+        device.reachable = True
+    queried = {
+        device_id: ({"name": "name", "ip": "10.0.0.1"}, {"type": "airSensor", "reachable": True}) for device_id in device_ids
+    }
+    monitor = Monitor(device_manager, cc_lib.client.Client())
+    results["monitor._diff"] = measure(lambda: monitor._diff(device_manager.devices, queried), repeat)
+    results["monitor._evaluate[steady]"] = measure(lambda: monitor._evaluate(queried), repeat)
+
+    changed = device_ids[::100]
+    toggle = [0]
+
+    def evaluateChanges():
+        toggle[0] ^= 1
+        for device_id in changed:
+            queried[device_id][0]["name"] = "name-{}".format(toggle[0])
+        monitor._evaluate(queried)
+        device_manager.flush()
+
+    results["monitor._evaluate[1%]"] = measure(evaluateChanges, repeat)
+    return results
+
+
+def compare(history: list, current: dict, threshold: float, window: int) -> list:
+    regressions = list()
+    for key, value in current.items():
+        previous = [run["results"][key] for run in history[-window:] if key in run["results"]]
+        if not previous:
+            continue
+        baseline = median(previous)
+        if baseline > 0 and value > baseline * (1 + threshold):
+            regressions.append((key, baseline, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the monitor and device manager hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--history", help="JSON file the results are appended to and compared against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown relative to the baseline")
+    parser.add_argument("--window", type=int, default=5, help="number of previous runs forming the baseline")
+    args = parser.parse_args()
+
+    history_path = path.abspath(args.history) if args.history else None
+    fake_cc_lib.install()
+    root = mkdtemp(prefix="blebox-micro-")
+    current = dict()
+    try:
+        for size in args.sizes:
+            prepareWorkdir(root, "fleet-{}".format(size))
+            for name, seconds in benchmarkFleet(size, args.repeat).items():
+                key = "{}@{}".format(name, size)
+                current[key] = seconds
+                print("{:<45} {:>12.6f}s".format(key, seconds), flush=True)
+    finally:
+        chdir("/")
+        shutil.rmtree(root, ignore_errors=True)
+    if not history_path:
+        return
+    history = list()
+    if path.exists(history_path):
+        with open(history_path) as file:
+            history = json.load(file)
+    regressions = compare(history, current, args.threshold, args.window)
+    history.append({"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "python": platform.python_version(), "results": current})
+    with open(history_path, "w") as file:
+        json.dump(history, file, indent=2)
+    for key, baseline, value in regressions:
+        print("regression: {} took {:.6f}s, baseline {:.6f}s".format(key, value, baseline))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# End-to-end benchmark against a simulated BleBox fleet on loopback addresses:
+#
+#     python -m benchmark.run --sizes 10 100 1000 10000
+#
+# cc_lib is replaced by a fake client, all other dependencies of the connector are required.
+
+
+from benchmark import fake_cc_lib
+from benchmark.fleet import SimulatedFleet, DEVICE_PATH, STATE_PATH
+from tempfile import mkdtemp
+from os import chdir, makedirs, path
+import argparse, json, time, resource, shutil
+
+
+def raiseFileLimit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def prepareWorkdir(root: str, name: str) -> str:
+    workdir = path.join(root, name)
+    makedirs(path.join(workdir, "storage"), exist_ok=True)
+    with open(path.join(workdir, "storage", "blebox.conf"), "w") as conf:
+        conf.write("[Senergy]\ndt_air_sensor = benchmark\n\n[Api]\nair_sensor_device = {}\nair_sensor_state = {}\n".format(DEVICE_PATH, STATE_PATH))
+    chdir(workdir)
+    return workdir
+
+
+def runFleet(size: int, port: int, args) -> dict:
+    import blebox
+    from blebox import config, DeviceManager, Monitor, ReadingPoller, EventEmitter
+    import cc_lib
+
+    config.Api.port = port
+    config.Discovery.targets = None
+    config.Discovery.slice_size = 0
+    config.Discovery.candidate_source = "sweep"
+    config.Discovery.probe_concurrency = args.probe_concurrency
+    config.Polling.workers = args.poll_workers
+    fleet = SimulatedFleet(size, port=port, latency=args.latency, failure_rate=args.failure_rate, hang_rate=args.hang_rate)
+    config.Discovery.targets = str(fleet.network)
+    fleet.start()
+    client = cc_lib.client.Client()
+    try:
+        device_manager = DeviceManager()
+        monitor = Monitor(device_manager, client)
+        start = time.perf_counter()
+        monitor._sweep()
+        discovery_time = time.perf_counter() - start
+        found = len(device_manager.devices)
+
+        emitter = EventEmitter(
+            lambda device_id, service, data: client.emmitEvent(
+                cc_lib.client.message.EventEnvelope(device_id, service, cc_lib.client.message.Message(data)), asynchronous=True
+            ),
+            lambda *failed: None,
+            max_size=config.Emission.max_size,
+            policy="block",
+            max_in_flight=config.Emission.max_in_flight
+        )
+        emitter.start()
+        produced = [0]
+
+        def onReading(device, air_state):
+            for sensor in air_state['air']['sensors']:
+                service = "reading_{}".format(sensor['type'])
+                emitter.put(device.id, service, json.dumps(device.getService(service, sensor['value'])))
+                produced[0] += 1
+
+        poller = ReadingPoller(device_manager, onReading)
+        start = time.perf_counter()
+        poller.sweep()
+        poll_time = time.perf_counter() - start
+        while emitter.acknowledged + emitter.failed < produced[0]:
+            time.sleep(0.001)
+        emission_time = time.perf_counter() - start
+        return {
+            "size": size,
+            "found": found,
+            "discovery_s": round(discovery_time, 3),
+            "poll_sweep_s": round(poll_time, 3),
+            "events": produced[0],
+            "events_per_s": round(produced[0] / emission_time, 1) if emission_time else 0.0
+        }
+    finally:
+        fleet.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a simulated BleBox fleet.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.0, help="response delay of every simulated device in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that are never answered")
+    parser.add_argument("--probe-concurrency", type=int, default=64)
+    parser.add_argument("--poll-workers", type=int, default=16)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    file_limit = raiseFileLimit()
+    fake_cc_lib.install()
+    root = mkdtemp(prefix="blebox-benchmark-")
+    results = list()
+    try:
+        for index, size in enumerate(args.sizes):
+            if file_limit < 2 * size + 1024:
+                # keep-alive sessions need one descriptor per device on each side of the loopback
+                print("warning: open file limit {} is too low for {} devices".format(file_limit, size), flush=True)
+            prepareWorkdir(root, "fleet-{}".format(size))
+            result = runFleet(size, args.port + index, args)
+            results.append(result)
+            print("{size:>7} devices  found {found:>7}  discovery {discovery_s:>8.3f}s  poll sweep {poll_sweep_s:>8.3f}s  {events_per_s:>10.1f} events/s".format(**result), flush=True)
+    finally:
+        chdir("/")
+        shutil.rmtree(root, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
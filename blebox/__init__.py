@@ -17,14 +17,34 @@
 
 from .configuration import *
 from .logger import *
+from .instrumentation import *
+from .profiling import *
+from .session_pool import *
+from .breaker import *
 from .discovery import *
 from .device import *
 from .device_manager import *
+from .poller import *
+from .reporting import *
+from .outbox import *
+from .emitter import *
+from .reachability import *
+from .sharding import *
 
 __all__ = (
     configuration.__all__,
     logger.__all__,
+    instrumentation.__all__,
+    profiling.__all__,
+    session_pool.__all__,
+    breaker.__all__,
     discovery.__all__,
     device.__all__,
-    device_manager.__all__
+    device_manager.__all__,
+    poller.__all__,
+    reporting.__all__,
+    outbox.__all__,
+    emitter.__all__,
+    reachability.__all__,
+    sharding.__all__
 )
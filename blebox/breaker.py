@@ -0,0 +1,101 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('circuit_breaker', )
+
+
+from .logger import root_logger
+from .configuration import config
+from threading import Lock
+import time, random
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breakers shared by reading polls and host validation. After
+    'Breaker.failure_threshold' consecutive failures a host's circuit opens and requests are skipped
+    for a backoff that doubles with every reopening, from 'Breaker.base_backoff' up to
+    'Breaker.max_backoff' seconds, randomised by 'Breaker.jitter'. Afterwards a single trial request
+    is let through (half-open); success closes the circuit, failure opens it again.
+    Only hosts with recent failures have state.
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        # host -> [state, failures, retry_at, opened, last_log]
+        self.__hosts = dict()
+        self.rejected = 0
+
+    def allow(self, host: str) -> bool:
+        entry = self.__hosts.get(host)
+        if entry is None:
+            return True
+        with self.__lock:
+            if entry[0] == CLOSED:
+                return True
+            if entry[0] == OPEN and time.monotonic() >= entry[2]:
+                entry[0] = HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self, host: str) -> None:
+        if host in self.__hosts:
+            with self.__lock:
+                entry = self.__hosts.pop(host, None)
+            if entry and entry[0] != CLOSED:
+                logger.info("closing circuit of '{}'".format(host))
+
+    def failure(self, host: str) -> bool:
+        """Record a failed request. Returns True if the failure should be logged."""
+        now = time.monotonic()
+        with self.__lock:
+            entry = self.__hosts.get(host)
+            if entry is None:
+                entry = self.__hosts[host] = [CLOSED, 0, 0.0, 0, now]
+                log = True
+            else:
+                log = now - entry[4] >= config.Breaker.log_interval
+            entry[1] += 1
+            if entry[0] == HALF_OPEN or (entry[0] == CLOSED and entry[1] >= config.Breaker.failure_threshold):
+                backoff = min(config.Breaker.max_backoff, config.Breaker.base_backoff * 2 ** entry[3])
+                backoff *= 1 + random.uniform(-config.Breaker.jitter, config.Breaker.jitter)
+                entry[0] = OPEN
+                entry[2] = now + backoff
+                entry[3] += 1
+                logger.warning("opening circuit of '{}' for {:.0f}s after {} failure(s)".format(host, backoff, entry[1]))
+                log = False
+            if log:
+                entry[4] = now
+            return log
+
+    def isOpen(self, host: str) -> bool:
+        entry = self.__hosts.get(host)
+        return entry is not None and entry[0] != CLOSED
+
+    def __len__(self):
+        return sum(1 for entry in list(self.__hosts.values()) if entry[0] != CLOSED)
+
+
+circuit_breaker = CircuitBreaker()
@@ -35,11 +35,110 @@ class BleboxConf:
     class Api:
         air_sensor_state = None
         air_sensor_device = None
+        port = 80
+
+    @section
+    class Discovery:
+        interval = 120
+        full_sweep_interval = 3600
+        hub_sync_window = 30
+        targets = None
+        candidate_source = "sweep"
+        blebox_ouis = None
+        slice_size = 0
+        probe_rate = 0
+        probe_concurrency = 64
+        probe_timeout = 1.0
+        icmp = False
+        validation_workers = 16
+        negative_ttl = 600
+        negative_max_ttl = 86400
+
+    @section
+    class Reachability:
+        failure_threshold = 3
+        recovery_threshold = 1
+
+    @section
+    class Breaker:
+        failure_threshold = 3
+        base_backoff = 60
+        max_backoff = 3600
+        jitter = 0.2
+        log_interval = 600
+
+    @section
+    class Polling:
+        interval = 300
+        type_intervals = None
+        device_intervals = None
+        workers = 16
+        timeout = 5.0
+
+    @section
+    class Sharding:
+        enabled = False
+        worker_id = None
+        replicas = 64
+        heartbeat_interval = 10
+        heartbeat_timeout = 30
+
+    @section
+    class Reporting:
+        change_only = False
+        absolute_deadband = 0.0
+        relative_deadband = 0.0
+        heartbeat_interval = 900
+
+    @section
+    class Aggregation:
+        enabled = False
+        window = 300
+        capacity = 32
+        value = "mean"
+
+    @section
+    class Emission:
+        max_size = 10000
+        policy = "block"
+        max_in_flight = 100
+
+    @section
+    class Outbox:
+        max_size = 100000
+        policy = "drop-oldest"
+        batch_size = 100
+        replay_rate = 50
+        replay_interval = 60
+
+    @section
+    class Http:
+        pool_size = 2
+        idle_timeout = 300
+
+    @section
+    class Storage:
+        batch_size = 500
+        batch_delay = 0.05
+        warm_start_max_age = 900
 
     @section
     class Senergy:
         dt_air_sensor = None
 
+    @section
+    class Metrics:
+        host = "127.0.0.1"
+        port = 0
+        per_device = False
+
+    @section
+    class Profiling:
+        enabled = False
+        duration = 0
+        sample_interval = 0.005
+        tracemalloc = True
+
     @section
     class Logger:
         level = "info"
@@ -53,3 +152,6 @@ config = BleboxConf('blebox.conf', user_dir)
 
 if not all((config.Senergy.dt_air_sensor, )):
     exit('Please provide a SENERGY device and service types')
+
+if config.Sharding.enabled and not config.Sharding.worker_id:
+    exit('Please provide a worker id that is stable across restarts for sharding')
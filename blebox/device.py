@@ -19,44 +19,59 @@ __all__ = ('BleboxAirSensor', 'device_type_map')
 
 
 from .configuration import config
-import cc_lib, datetime
+from typing import Iterable, List, Tuple
+import cc_lib, datetime, json
 
 
-def mapReading(payload):
-    return {
+UNIT = 'µg/m³'
+
+
+def readingTime() -> str:
+    return '{}Z'.format(datetime.datetime.utcnow().isoformat())
+
+
+def mapReading(payload, aggregates=None):
+    reading = {
         'value': payload,
-        'unit': 'µg/m³',
-        'time': '{}Z'.format(datetime.datetime.utcnow().isoformat())
+        'unit': UNIT,
+        'time': readingTime()
     }
+    if aggregates:
+        reading['aggregates'] = aggregates
+    return reading
 
 
 class ReadingPM1(cc_lib.types.Service):
     local_id = "reading_pm1"
 
     @staticmethod
-    def task(payload):
-        return mapReading(payload)
+    def task(payload, aggregates=None):
+        return mapReading(payload, aggregates)
 
 
 class ReadingPM25(cc_lib.types.Service):
     local_id = "reading_pm2.5"
 
     @staticmethod
-    def task(payload):
-        return mapReading(payload)
+    def task(payload, aggregates=None):
+        return mapReading(payload, aggregates)
 
 
 class ReadingPM10(cc_lib.types.Service):
     local_id = "reading_pm10"
 
     @staticmethod
-    def task(payload):
-        return mapReading(payload)
+    def task(payload, aggregates=None):
+        return mapReading(payload, aggregates)
 
 
 class BleboxAirSensor(cc_lib.types.Device):
     device_type_id = config.Senergy.dt_air_sensor
     services = (ReadingPM1, ReadingPM25, ReadingPM10)
+    # JSON of mapReading() per service, filled with pre-encoded value, time and aggregates
+    templates = {
+        service.local_id: '{"value": %s, "unit": ' + json.dumps(UNIT).replace('%', '%%') + ', "time": %s%s}' for service in services
+    }
 
     def __init__(self, id, name, ip=None):
         self.id = id
@@ -67,6 +82,20 @@ class BleboxAirSensor(cc_lib.types.Device):
     def getService(self, service, *args):
         return super().getService(service).task(*args)
 
+    def encodeReadings(self, readings: Iterable[Tuple[str, object, dict]]) -> List[Tuple[str, str]]:
+        """
+        Serialize (service, value, aggregates) readings of one poll response to the same JSON
+        json.dumps(getService(...)) produces, with a single timestamp for all of them.
+        """
+        timestamp = json.dumps(readingTime())
+        encoded = list()
+        for service, value, aggregates in readings:
+            value = int.__repr__(value) if type(value) is int else json.dumps(value)
+            encoded.append(
+                (service, self.templates[service] % (value, timestamp, ', "aggregates": ' + json.dumps(aggregates) if aggregates else ''))
+            )
+        return encoded
+
     def __iter__(self):
         items = (
             ("name", self.name),
@@ -19,11 +19,15 @@ __all__ = ('DeviceManager', )
 
 from .logger import root_logger
 from .device import device_type_map
-from typing import Dict
-from threading import Lock
+from .configuration import config
+from .instrumentation import metrics
+from typing import Mapping, Iterable, Tuple
+from types import MappingProxyType
+from threading import Lock, Thread
+from queue import Queue, Empty
 from sqlite3 import connect as sqlliteConnect
 from os import getcwd, path
-import cc_lib
+import time, cc_lib
 
 
 logger = root_logger.getChild(__name__.split(".", 1)[-1])
@@ -33,25 +37,84 @@ class DeviceManager:
 
     def __init__(self):
         self.__device_pool = dict()
+        self.__snapshot = MappingProxyType(dict())
+        self.__generation = 0
         self.__lock = Lock()
         self.__db_path = path.join(getcwd(),"storage/devices.sqlite3")
-        with sqlliteConnect(self.__db_path) as conn:
-            conn.execute("CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY UNIQUE, name TEXT, type TEXT)")
-        conn.close()
+        self.__conn = sqlliteConnect(self.__db_path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        with self.__conn:
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY UNIQUE, name TEXT, type TEXT)")
+            columns = {row[1] for row in self.__conn.execute("PRAGMA table_info(devices)")}
+            for column, c_type in (("ip", "TEXT"), ("reachable", "INTEGER"), ("last_seen", "REAL")):
+                if column not in columns:
+                    self.__conn.execute("ALTER TABLE devices ADD COLUMN {} {}".format(column, c_type))
+        self.__write_queue = Queue()
+        self.__data_version = self.__conn.execute("PRAGMA data_version").fetchone()[0]
         self.__loadFromDB()
+        self.__publish()
+        self.__writer = Thread(target=self.__writeBehind, name="deviceManagerWriter", daemon=True)
+        self.__writer.start()
+
+    def __writeBehind(self):
+        """Group queued statements into batched transactions on the long-lived connection."""
+        while True:
+            batch = [self.__write_queue.get()]
+            deadline = time.monotonic() + config.Storage.batch_delay
+            while len(batch) < config.Storage.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.__write_queue.get(timeout=timeout))
+                except Empty:
+                    break
+            start = time.monotonic()
+            try:
+                with self.__conn:
+                    for statement, params in batch:
+                        self.__conn.executemany(statement, params)
+                metrics.db_write_duration.observe(time.monotonic() - start)
+            except Exception as ex:
+                metrics.errors.inc("device_manager", type(ex).__name__)
+                logger.error("could not write {} change(s) to database - {}".format(len(batch), ex))
+            finally:
+                for _ in batch:
+                    self.__write_queue.task_done()
+
+    def __publish(self):
+        """Replace the read-only snapshot of the pool. Must be called with the lock held after every change."""
+        self.__snapshot = MappingProxyType(self.__device_pool.copy())
+        self.__generation += 1
+
+    def __write(self, statement: str, params: list) -> None:
+        if params:
+            self.__write_queue.put((statement, params))
+
+    def flush(self) -> None:
+        """Block until all queued changes are committed."""
+        self.__write_queue.join()
 
     def add(self, device: cc_lib.types.Device, d_type) -> None:
-        if not isinstance(device, cc_lib.types.Device):
-            raise TypeError
+        self.addMany(((device, d_type), ))
+
+    def addMany(self, devices: Iterable[Tuple[cc_lib.types.Device, str]]) -> None:
+        rows = list()
         self.__lock.acquire()
-        if device.id not in self.__device_pool:
-            self.__device_pool[device.id] = device
-            with sqlliteConnect(self.__db_path) as conn:
-                conn.execute("INSERT INTO devices (id, name, type) VALUES (?, ?, ?)", (device.id, device.name, d_type))
-            conn.close()
-        else:
-            logger.warning("device '{}' already in pool".format(device.id))
+        for device, d_type in devices:
+            if not isinstance(device, cc_lib.types.Device):
+                self.__lock.release()
+                raise TypeError
+            if device.id not in self.__device_pool:
+                self.__device_pool[device.id] = device
+                rows.append((device.id, device.name, d_type, device.ip, int(device.reachable), time.time() if device.reachable else None))
+            else:
+                logger.warning("device '{}' already in pool".format(device.id))
+        if rows:
+            self.__publish()
         self.__lock.release()
+        self.__write("INSERT OR REPLACE INTO devices (id, name, type, ip, reachable, last_seen) VALUES (?, ?, ?, ?, ?, ?)", rows)
 
     def delete(self, device_id: str) -> None:
         if not isinstance(device_id, str):
@@ -59,9 +122,8 @@ class DeviceManager:
         self.__lock.acquire()
         try:
             del self.__device_pool[device_id]
-            with sqlliteConnect(self.__db_path) as conn:
-                conn.execute("DELETE FROM devices WHERE id=(?)", (device_id,))
-            conn.close()
+            self.__publish()
+            self.__write("DELETE FROM devices WHERE id=(?)", [(device_id,)])
         except KeyError:
             logger.warning("device '{}' does not exist in device pool".format(device_id))
         self.__lock.release()
@@ -69,41 +131,89 @@ class DeviceManager:
     def get(self, device_id: str) -> cc_lib.types.Device:
         if not isinstance(device_id, str):
             raise TypeError
-        self.__lock.acquire()
         try:
-            device = self.__device_pool[device_id]
+            return self.__snapshot[device_id]
         except KeyError:
             logger.error("device '{}' not in pool".format(device_id))
-            self.__lock.release()
             raise
-        self.__lock.release()
-        return device
 
     def update(self, device: cc_lib.types.Device):
-        if not isinstance(device, cc_lib.types.Device):
-            raise TypeError
-        with sqlliteConnect(self.__db_path) as conn:
-            conn.execute("UPDATE devices SET name=(?) WHERE id=(?)", (device.name, device.id))
-        conn.close()
+        self.updateMany((device, ))
+
+    def updateMany(self, devices: Iterable[cc_lib.types.Device]) -> None:
+        rows = list()
+        for device in devices:
+            if not isinstance(device, cc_lib.types.Device):
+                raise TypeError
+            rows.append((device.name, device.id))
+        if rows:
+            self.__lock.acquire()
+            self.__generation += 1
+            self.__lock.release()
+        self.__write("UPDATE devices SET name=(?) WHERE id=(?)", rows)
+
+    def saveStateMany(self, devices: Iterable[cc_lib.types.Device]) -> None:
+        """Persist address and reachability; reachable devices also refresh their last-seen time."""
+        now = time.time()
+        rows = list()
+        for device in devices:
+            if not isinstance(device, cc_lib.types.Device):
+                raise TypeError
+            rows.append((device.ip, int(device.reachable), int(device.reachable), now, device.id))
+        self.__write("UPDATE devices SET ip=(?), reachable=(?), last_seen=CASE WHEN (?) THEN (?) ELSE last_seen END WHERE id=(?)", rows)
 
     def clear(self) -> None:
         self.__lock.acquire()
         self.__device_pool.clear()
-        with sqlliteConnect(self.__db_path) as conn:
-            conn.execute("DROP TABLE IF EXISTS devices")
-            conn.execute("CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY UNIQUE, name TEXT, type TEXT)")
-        conn.close()
+        self.__publish()
+        self.__write("DELETE FROM devices", [()])
         self.__lock.release()
 
+    def reload(self) -> bool:
+        """Apply changes other processes committed to the database. Returns True if the pool changed."""
+        data_version = self.__conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.__data_version:
+            return False
+        self.__data_version = data_version
+        rows = self.__conn.execute("SELECT id, name, type, ip, reachable FROM devices").fetchall()
+        stored = {row[0] for row in rows}
+        changed = False
+        with self.__lock:
+            for device_id in [device_id for device_id in self.__device_pool if device_id not in stored]:
+                del self.__device_pool[device_id]
+                changed = True
+            for id, name, type, ip, reachable in rows:
+                device = self.__device_pool.get(id)
+                if device is None:
+                    if type not in device_type_map:
+                        logger.warning("skipping '{}' of unknown type '{}'".format(id, type))
+                        continue
+                    device = device_type_map[type](id, name, ip)
+                    self.__device_pool[id] = device
+                    changed = True
+                elif device.name != name:
+                    device.name = name
+                    changed = True
+                device.ip = ip
+                device.reachable = bool(ip and reachable)
+            if changed:
+                self.__publish()
+        return changed
+
     @property
-    def devices(self) -> Dict[str, cc_lib.types.Device]:
-        self.__lock.acquire()
-        devices = self.__device_pool.copy()
-        self.__lock.release()
-        return devices
+    def devices(self) -> Mapping[str, cc_lib.types.Device]:
+        """Read-only snapshot of the device pool, replaced on every change and safe to read without locking."""
+        return self.__snapshot
+
+    @property
+    def generation(self) -> int:
+        """Incremented whenever devices are added, deleted or renamed."""
+        return self.__generation
 
     def __loadFromDB(self):
-        with sqlliteConnect(self.__db_path) as conn:
-            for id, name, type in conn.execute("SELECT * FROM devices"):
-                self.__device_pool[id] = device_type_map[type](id, name)
-        conn.close()
+        """Restore devices with their last known address. Devices seen recently enough start out reachable."""
+        horizon = time.time() - config.Storage.warm_start_max_age
+        for id, name, type, ip, reachable, last_seen in self.__conn.execute("SELECT id, name, type, ip, reachable, last_seen FROM devices"):
+            device = device_type_map[type](id, name, ip)
+            device.reachable = bool(ip and reachable and last_seen and last_seen >= horizon)
+            self.__device_pool[id] = device
@@ -22,40 +22,58 @@ from .logger import root_logger
 from .device_manager import DeviceManager
 from .device import device_type_map
 from .configuration import config
-from subprocess import call, check_output, DEVNULL
-from socket import gethostbyname, getfqdn
-from threading import Thread
+from .probe import probeHosts
+from .session_pool import http_pool
+from .breaker import circuit_breaker
+from .profiling import profiled
+from .negative_cache import NegativeCache
+from .instrumentation import metrics
+from .hub_sync import HubSynchronizer
+from .reachability import ReachabilityTracker
+from .sharding import ShardCoordinator
+from .neighbors import readNeighbors, orderNeighbors
+from subprocess import check_output
+from socket import gethostbyname, getfqdn, inet_ntoa, socket, AF_INET, SOCK_DGRAM
+from ipaddress import IPv4Network, collapse_addresses
+from struct import pack
+from typing import Iterable, Iterator
+from threading import Thread, Event
+from queue import Queue
 from platform import system
 from os import getenv
-from requests import get, exceptions
+from requests import exceptions
 import time, cc_lib
 
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
 
 logger = root_logger.getChild(__name__.split(".", 1)[-1])
 
 
-def ping(host) -> bool:
-    return call(['ping', '-c', '2', '-t', '2', host], stdout=DEVNULL, stderr=DEVNULL) == 0
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
 
 
-def getLocalIP() -> str:
+def getLocalIPs() -> list:
     try:
         if config.RuntimeEnv.container:
             host_ip = getenv("HOST_IP")
             if not host_ip:
                 raise Exception("environment variable 'HOST_IP' not set")
-            return host_ip
+            return [host_ip]
         else:
             sys_type = system().lower()
             if 'linux' in sys_type:
-                local_ip = check_output(['hostname', '-I']).decode()
-                local_ip = local_ip.replace(' ', '')
-                local_ip = local_ip.replace('\n', '')
-                return local_ip
+                local_ips = check_output(['hostname', '-I']).decode().split()
+                return [ip for ip in local_ips if ip.count('.') == 3]
             elif 'darwin' in sys_type:
                 local_ip = gethostbyname(getfqdn())
                 if type(local_ip) is str and local_ip.count('.') == 3:
-                    return local_ip
+                    return [local_ip]
+                return list()
             else:
                 raise Exception("platform not supported")
     except Exception as ex:
@@ -63,55 +81,169 @@ def getLocalIP() -> str:
         exit()
 
 
-def getIpRange(local_ip) -> list:
-    split_ip = local_ip.rsplit('.', 1)
-    base_ip = split_ip[0] + '.'
-    if len(split_ip) > 1:
-        ip_range = [str(base_ip) + str(i) for i in range(2,255)]
-        ip_range.remove(local_ip)
-        return ip_range
-    return list()
+def getInterfaceNetwork(interface: str) -> IPv4Network:
+    if ioctl is None:
+        raise OSError("interface lookup not supported on this platform")
+    with socket(AF_INET, SOCK_DGRAM) as sock:
+        request = pack('256s', interface[:15].encode())
+        address = inet_ntoa(ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+        netmask = inet_ntoa(ioctl(sock.fileno(), SIOCGIFNETMASK, request)[20:24])
+    return IPv4Network("{}/{}".format(address, netmask), strict=False)
 
 
-def discoverHostsWorker(ip_range, alive_hosts):
-    for ip in ip_range:
-        if ping(ip):
-            alive_hosts.append(ip)
+def getTargetNetworks() -> list:
+    networks = list()
+    targets = [target.strip() for target in str(config.Discovery.targets or str()).split(',') if target.strip()]
+    if not targets:
+        return [IPv4Network("{}/24".format(ip), strict=False) for ip in getLocalIPs()]
+    for target in targets:
+        try:
+            networks.append(IPv4Network(target, strict=False))
+        except ValueError:
+            try:
+                networks.append(getInterfaceNetwork(target))
+            except OSError as ex:
+                logger.error("can't resolve discovery target '{}' - {}".format(target, ex))
+    return networks
 
 
-def discoverHosts() -> list:
-    ip_range = getIpRange(getLocalIP())
-    alive_hosts = list()
-    workers = list()
-    bin = 0
-    bin_size = 3
-    if ip_range:
-        for i in range(int(len(ip_range) / bin_size)):
-            worker = Thread(target=discoverHostsWorker, name='discoverHostsWorker', args=(ip_range[bin:bin+bin_size], alive_hosts))
-            workers.append(worker)
-            worker.start()
-            bin = bin + bin_size
-        if ip_range[bin:]:
-            worker = Thread(target=discoverHostsWorker, name='discoverHostsWorker', args=(ip_range[bin:], alive_hosts))
-            workers.append(worker)
-            worker.start()
-        for worker in workers:
-            worker.join()
-    return alive_hosts
+def iterHosts(networks: Iterable[IPv4Network], exclude=()) -> Iterator[str]:
+    exclude = set(exclude)
+    for network in collapse_addresses(networks):
+        for address in network.hosts():
+            address = str(address)
+            if address not in exclude:
+                yield address
+
+
+def iterCandidates(networks: Iterable[IPv4Network], exclude=(), neighbors: dict = None) -> Iterator[str]:
+    """
+    Yield discovery candidates according to 'Discovery.candidate_source': 'sweep' walks all target
+    addresses, 'neighbors' only the hosts present in the neighbor table and 'neighbors+sweep' the
+    neighbors first followed by the remaining addresses. Without neighbor entries the sweep is used.
+    """
+    source = str(config.Discovery.candidate_source or "sweep").lower()
+    networks = list(networks)
+    if source in ("neighbors", "neighbors+sweep"):
+        if neighbors is None:
+            neighbors = readNeighbors()
+        exclude = set(exclude)
+        ouis = str(config.Discovery.blebox_ouis or str()).split(',')
+        candidates = [ip for ip in orderNeighbors(neighbors, networks, ouis) if ip not in exclude]
+        if candidates:
+            yield from candidates
+            if source == "neighbors":
+                return
+            exclude.update(candidates)
+        else:
+            logger.debug("no neighbor candidates - falling back to sweep")
+    yield from iterHosts(networks, exclude)
+
+
+class DiscoveryTargets:
+    """
+    Lazily walks the configured discovery networks. With 'slice_size' set, every call to
+    'nextSlice' continues where the previous one stopped, so large networks are covered
+    over several monitor cycles.
+    """
+
+    def __init__(self, neighbors: dict = None):
+        self.__hosts = None
+        self.__neighbors = neighbors
+
+    def __newPass(self) -> Iterator[str]:
+        return iterCandidates(getTargetNetworks(), exclude=getLocalIPs(), neighbors=self.__neighbors)
+
+    def nextSlice(self) -> Iterator[str]:
+        if self.__hosts is None:
+            self.__hosts = self.__newPass()
+        slice_size = config.Discovery.slice_size
+        count = 0
+        for host in self.__hosts:
+            yield host
+            count += 1
+            if slice_size > 0 and count >= slice_size:
+                return
+        self.__hosts = None
+
+    @property
+    def in_pass(self) -> bool:
+        """True while a pass over the networks was started but not finished."""
+        return self.__hosts is not None
+
+
+def _record(hosts: Iterable[str], record: set) -> Iterator[str]:
+    for host in hosts:
+        record.add(host)
+        yield host
+
+
+def discoverHosts(hosts: Iterable[str] = None) -> Iterator[str]:
+    if hosts is None:
+        hosts = iterCandidates(getTargetNetworks(), exclude=getLocalIPs())
+    return probeHosts(
+        hosts,
+        port=config.Api.port,
+        concurrency=config.Discovery.probe_concurrency,
+        timeout=config.Discovery.probe_timeout,
+        icmp=config.Discovery.icmp,
+        rate=config.Discovery.probe_rate
+    )
 
 
 class Monitor(Thread):
 
-    def __init__(self, device_manager: DeviceManager, client: cc_lib.client.Client):
+    def __init__(self, device_manager: DeviceManager, client: cc_lib.client.Client, reachability: ReachabilityTracker = None, shard: ShardCoordinator = None):
         super().__init__(name="monitor", daemon=True)
         self.__device_manager = device_manager
         self.__client = client
+        self.__shard = shard
+        self.__reachability = reachability or ReachabilityTracker()
+        self.__reachability.addListener(self.__onReachabilityChange)
+        self.__neighbors = dict()
+        self.__targets = DiscoveryTargets(self.__neighbors)
+        self.__sweep_requested = Event()
+        self.__last_sweep = None
+        self.__search_backoff = dict()
+        self.__negative_cache = NegativeCache()
+        self.__hub_sync = HubSynchronizer(device_manager, client)
 
-    def _validateHostsWorker(self, hosts, valid_hosts):
-        for host in hosts:
+    def __owns(self, device_id: str) -> bool:
+        return self.__shard is None or self.__shard.owns(device_id)
+
+    def __onReachabilityChange(self, device: cc_lib.types.Device, reachable: bool):
+        device.reachable = reachable
+        self.__device_manager.saveStateMany((device, ))
+        if not self.__owns(device.id):
+            return
+        try:
+            if reachable:
+                logger.info("'{}' with id '{}' is reachable again".format(device.name, device.id))
+                self.__client.connectDevice(device, asynchronous=True)
+            else:
+                logger.info("can't find '{}' with id '{}'".format(device.name, device.id))
+                self.__client.disconnectDevice(device, asynchronous=True)
+            if self.__shard:
+                self.__shard.setConnected(device.id, reachable)
+        except (cc_lib.client.DeviceConnectError, cc_lib.client.DeviceDisconnectError, cc_lib.client.NotConnectedError):
+            pass
+
+    @profiled("validateHosts")
+    def _validateHostsWorker(self, host_queue: Queue, valid_hosts: dict, use_cache: bool, skipped_hosts: set):
+        while True:
+            host = host_queue.get()
+            if host is None:
+                break
+            mac = self.__neighbors.get(host)
+            if use_cache and self.__negative_cache.contains(host, mac):
+                continue
+            if not circuit_breaker.allow(host):
+                skipped_hosts.add(host)
+                continue
             try:
-                response = get(url="http://{}/{}".format(host, config.Api.air_sensor_device), timeout=5)
-                if response.status_code == 200 and 'blebox' in response.headers.get('Server'):
+                response = http_pool.get(host, config.Api.air_sensor_device, timeout=5)
+                circuit_breaker.success(host)
+                if response.status_code == 200 and 'blebox' in response.headers.get('Server', str()):
                     host_info = response.json()
                     if "device" in host_info.keys():
                         host_info = host_info.get("device")
@@ -125,101 +257,193 @@ class Monitor(Thread):
                             "reachable": True
                         }
                     )
+                    self.__negative_cache.accept(host, mac)
+                    metrics.hosts_validated.inc()
+                else:
+                    http_pool.release(host)
+                    # only hosts that answered without being a BleBox are cached, transport errors are left to the circuit breaker
+                    if 'blebox' not in response.headers.get('Server', str()):
+                        self.__negative_cache.reject(host, mac)
             except exceptions.RequestException:
-                pass
+                http_pool.release(host)
+                circuit_breaker.failure(host)
 
-    def _validateHosts(self, hosts) -> dict:
+    def _validateHosts(self, hosts: Iterable[str], wanted: set = None, use_cache: bool = True, skipped_hosts: set = None) -> dict:
+        """
+        Validate hosts as they arrive. If 'wanted' is given, stop consuming hosts once all wanted ids were found.
+        Hosts in the negative cache are skipped unless 'use_cache' is false. Hosts skipped because
+        their circuit is open are added to 'skipped_hosts'.
+        """
+        if skipped_hosts is None:
+            skipped_hosts = set()
         valid_hosts = dict()
+        host_queue = Queue()
         workers = list()
-        bin = 0
-        bin_size = 2
-        if len(hosts) <= bin_size:
-            worker = Thread(target=self._validateHostsWorker, name='validateHostsWorker', args=(hosts, valid_hosts))
+        for i in range(max(1, config.Discovery.validation_workers)):
+            worker = Thread(target=self._validateHostsWorker, name='validateHostsWorker', args=(host_queue, valid_hosts, use_cache, skipped_hosts))
             workers.append(worker)
             worker.start()
-        else:
-            for i in range(int(len(hosts) / bin_size)):
-                worker = Thread(target=self._validateHostsWorker, name='validateHostsWorker',
-                                args=(hosts[bin:bin + bin_size], valid_hosts))
-                workers.append(worker)
-                worker.start()
-                bin = bin + bin_size
-            if hosts[bin:]:
-                worker = Thread(target=self._validateHostsWorker, name='validateHostsWorker', args=(hosts[bin:], valid_hosts))
-                workers.append(worker)
-                worker.start()
+        for host in hosts:
+            host_queue.put(host)
+            if wanted and wanted.issubset(valid_hosts):
+                break
+        if hasattr(hosts, "close"):
+            hosts.close()
+        for worker in workers:
+            host_queue.put(None)
         for worker in workers:
             worker.join()
+        self.__negative_cache.flush()
+        logger.debug("negative cache: {} entries, {} hits, {} misses".format(
+            len(self.__negative_cache), self.__negative_cache.hits, self.__negative_cache.misses)
+        )
         return valid_hosts
 
-    def _diff(self, known, unknown) -> tuple:
+    def _diff(self, known, unknown, scanned=None, skipped=None) -> tuple:
+        if scanned is not None:
+            known = {key: device for key, device in known.items() if key in unknown or device.ip in scanned}
+        if skipped:
+            known = {key: device for key, device in known.items() if key in unknown or device.ip not in skipped}
         known_set = set(known)
         unknown_set = set(unknown)
         missing = known_set - unknown_set
         new = unknown_set - known_set
-        changed = {key for key in known_set & unknown_set if dict(known[key]) != unknown[key][0]}
+        changed = {
+            key for key in known_set & unknown_set if (known[key].name, known[key].ip) != (unknown[key][0]["name"], unknown[key][0]["ip"])
+        }
         return missing, new, changed
 
-    def _evaluate(self, queried_devices):
-        missing_devices, new_devices, changed_devices = self._diff(self.__device_manager.devices, queried_devices)
+    @profiled("evaluate")
+    def _evaluate(self, queried_devices, scanned_hosts=None, skipped_hosts=None):
+        start = time.monotonic()
+        missing_devices, new_devices, changed_devices = self._diff(self.__device_manager.devices, queried_devices, scanned_hosts, skipped_hosts)
         updated_devices = list()
         if missing_devices:
             for device_id in missing_devices:
-                logger.info("can't find '{}' with id '{}'".format(
-                    self.__device_manager.get(device_id).name, device_id)
-                )
-                try:
-                    self.__client.disconnectDevice(device_id)
-                    self.__device_manager.get(device_id).reachable = False
-                except (cc_lib.client.DeviceDisconnectError, cc_lib.client.NotConnectedError):
-                    pass
+                self.__reachability.report(self.__device_manager.get(device_id), False)
         if new_devices:
             futures = list()
             for device_id in new_devices:
                 device = device_type_map[queried_devices[device_id][1]["type"]](device_id, **queried_devices[device_id][0])
                 logger.info("found '{}' with id '{}'".format(device.name, device.id))
                 futures.append((device, self.__client.addDevice(device, asynchronous=True)))
+            added_devices = list()
             for device, future in futures:
                 future.wait()
                 try:
                     future.result()
-                    self.__device_manager.add(device, queried_devices[device.id][1]["type"])
-                    self.__client.connectDevice(device, asynchronous=True)
+                    added_devices.append((device, queried_devices[device.id][1]["type"]))
                     device.reachable = True
+                    if self.__owns(device.id):
+                        self.__client.connectDevice(device, asynchronous=True)
+                        if self.__shard:
+                            self.__shard.setConnected(device.id, True)
                 except (cc_lib.client.DeviceAddError, cc_lib.client.DeviceUpdateError):
                     pass
+            self.__device_manager.addMany(added_devices)
         if changed_devices:
             futures = list()
             for device_id in changed_devices:
                 device = self.__device_manager.get(device_id)
                 prev_device_name = device.name
-                prev_device_reachable_state = device.reachable
                 device.name = queried_devices[device_id][0]["name"]
                 device.ip = queried_devices[device_id][0]["ip"]
-                device.reachable = queried_devices[device_id][1]["reachable"]
-                if device.reachable != prev_device_reachable_state:
-                    if device.reachable:
-                        self.__client.connectDevice(device, asynchronous=True)
-                    else:
-                        self.__client.disconnectDevice(device, asynchronous=True)
                 if device.name != prev_device_name:
                     futures.append((device, prev_device_name, self.__client.updateDevice(device, asynchronous=True)))
             for device, prev_device_name, future in futures:
                 future.wait()
                 try:
                     future.result()
-                    updated_devices.append(device.id)
-                    self.__device_manager.update(device)
+                    updated_devices.append(device)
                 except cc_lib.client.DeviceUpdateError:
                     device.name = prev_device_name
+            self.__device_manager.updateMany(updated_devices)
+        known_devices = self.__device_manager.devices
+        for device_id in queried_devices:
+            if device_id in known_devices and device_id not in new_devices:
+                self.__reachability.report(known_devices[device_id], True)
+        self.__device_manager.saveStateMany(
+            device for device_id, device in self.__device_manager.devices.items() if device_id in queried_devices or device_id in missing_devices
+        )
         if any((missing_devices, new_devices, updated_devices)):
-            try:
-                self.__client.syncHub(list(self.__device_manager.devices.values()), asynchronous=True)
-            except cc_lib.client.HubError:
-                pass
+            self.__hub_sync.request()
+        metrics.evaluate_duration.observe(time.monotonic() - start)
+
+    def requestSweep(self) -> None:
+        self.__sweep_requested.set()
+
+    def __refreshNeighbors(self):
+        neighbors = readNeighbors()
+        self.__neighbors.clear()
+        self.__neighbors.update(neighbors)
+
+    def _sweep(self):
+        self.__refreshNeighbors()
+        scanned_hosts = None
+        targets = self.__targets.nextSlice()
+        if config.Discovery.slice_size > 0:
+            scanned_hosts = set()
+            targets = _record(targets, scanned_hosts)
+        start = time.monotonic()
+        skipped_hosts = set()
+        unknown_devices = self._validateHosts(discoverHosts(targets), skipped_hosts=skipped_hosts)
+        metrics.discovery_duration.observe(time.monotonic() - start, "full")
+        self._evaluate(unknown_devices, scanned_hosts, skipped_hosts)
+
+    def __searchCandidates(self, known_devices: dict, found_devices: dict, now: float) -> set:
+        """
+        Devices that were reachable until now but did not answer at their last address and whose
+        search backoff expired. Unreachable devices are left to the full sweep.
+        """
+        for device_id in [device_id for device_id in self.__search_backoff if device_id in found_devices or device_id not in known_devices]:
+            del self.__search_backoff[device_id]
+        return {
+            device_id for device_id, device in known_devices.items()
+            if device_id not in found_devices and device.reachable and self.__search_backoff.get(device_id, (0, 0))[0] <= now
+        }
+
+    def __backOffSearch(self, device_ids: set, now: float) -> None:
+        """Delay the next search for devices a search did not find, doubling up to 'Discovery.full_sweep_interval'."""
+        for device_id in device_ids:
+            delay = self.__search_backoff.get(device_id, (0, config.Discovery.interval / 2))[1] * 2
+            delay = min(delay, config.Discovery.full_sweep_interval)
+            self.__search_backoff[device_id] = (now + delay, delay)
+
+    def _revalidate(self):
+        start = time.monotonic()
+        known_devices = {device_id: device for device_id, device in self.__device_manager.devices.items() if device.ip}
+        scanned_hosts = {device.ip for device in known_devices.values()}
+        skipped_hosts = set()
+        unknown_devices = self._validateHosts(list(scanned_hosts), use_cache=False, skipped_hosts=skipped_hosts)
+        # devices behind an open circuit were not checked and are neither missing nor moved
+        moved_devices = {
+            device_id for device_id in self.__searchCandidates(known_devices, unknown_devices, start) if known_devices[device_id].ip not in skipped_hosts
+        }
+        if moved_devices:
+            logger.debug("searching for {} device(s) not found at their last address".format(len(moved_devices)))
+            self.__refreshNeighbors()
+            targets = _record(iterCandidates(getTargetNetworks(), exclude=getLocalIPs(), neighbors=self.__neighbors), scanned_hosts)
+            unknown_devices.update(self._validateHosts(discoverHosts(targets), wanted=moved_devices, skipped_hosts=skipped_hosts))
+            self.__backOffSearch(moved_devices - set(unknown_devices), start)
+        metrics.discovery_duration.observe(time.monotonic() - start, "known")
+        self._evaluate(unknown_devices, scanned_hosts - skipped_hosts, skipped_hosts)
+
+    @profiled("monitor")
+    def _cycle(self):
+        # a sliced pass continues on consecutive cycles, the full sweep interval counts from its end
+        if self.__targets.in_pass or self.__sweep_requested.is_set() or self.__last_sweep is None or time.monotonic() - self.__last_sweep >= config.Discovery.full_sweep_interval:
+            self.__sweep_requested.clear()
+            self._sweep()
+            if not self.__targets.in_pass:
+                self.__last_sweep = time.monotonic()
+        else:
+            self._revalidate()
 
     def run(self):
+        self.__hub_sync.start()
+        if self.__device_manager.devices:
+            self._revalidate()
+            self.__sweep_requested.set()
         while True:
-            unknown_devices = self._validateHosts(discoverHosts())
-            self._evaluate(unknown_devices)
-            time.sleep(120)
+            self._cycle()
+            self.__sweep_requested.wait(config.Discovery.interval)
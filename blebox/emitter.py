@@ -0,0 +1,133 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('EventEmitter', )
+
+
+from .logger import root_logger
+from .instrumentation import metrics
+from typing import Callable
+from threading import Thread, Condition
+from collections import OrderedDict, deque
+from itertools import count
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class EventEmitter(Thread):
+    """
+    Bounded stage between the reading pollers and cc_lib. At most 'max_size' events are queued and
+    at most 'max_in_flight' emissions wait for their acknowledgement. When the queue is full the
+    'block' policy makes producers wait, 'drop-oldest' discards the oldest queued event and
+    'coalesce' keeps only the latest value per device and service. Events that can't be emitted
+    are handed to 'on_failure'.
+    """
+
+    policies = ("block", "drop-oldest", "coalesce")
+
+    def __init__(self, emit: Callable[[str, str, str], object], on_failure: Callable[[str, str, str], None], max_size: int, policy: str, max_in_flight: int):
+        super().__init__(name="eventEmitter", daemon=True)
+        if policy not in self.policies:
+            logger.warning("unknown overflow policy '{}' - using 'block'".format(policy))
+            policy = "block"
+        self.__emit = emit
+        self.__on_failure = on_failure
+        self.__max_size = max(1, max_size)
+        self.__policy = policy
+        self.__max_in_flight = max(1, max_in_flight)
+        self.__queue = OrderedDict()
+        self.__in_flight = deque()
+        self.__cond = Condition()
+        self.__seq = count()
+        self.dropped = 0
+        self.coalesced = 0
+        self.acknowledged = 0
+        self.failed = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, device_id: str, service: str, data: str) -> None:
+        with self.__cond:
+            if self.__policy == "coalesce":
+                key = (device_id, service)
+                if key in self.__queue:
+                    enqueued = self.__queue[key][0]
+                    self.__queue[key] = (enqueued, device_id, service, data)
+                    self.coalesced += 1
+                    return
+            else:
+                key = next(self.__seq)
+            if len(self.__queue) >= self.__max_size:
+                if self.__policy == "block":
+                    while len(self.__queue) >= self.__max_size:
+                        self.__cond.wait()
+                else:
+                    self.__queue.popitem(last=False)
+                    self.dropped += 1
+            self.__queue[key] = (time.monotonic(), device_id, service, data)
+            self.__cond.notify_all()
+
+    def __take(self) -> tuple:
+        with self.__cond:
+            while not self.__queue:
+                self.__cond.wait()
+            _, item = self.__queue.popitem(last=False)
+            self.__cond.notify_all()
+            return item
+
+    def __acknowledge(self):
+        enqueued, device_id, service, data, future = self.__in_flight.popleft()
+        future.wait()
+        try:
+            future.result()
+        except Exception as ex:
+            self.failed += 1
+            metrics.errors.inc("emission", type(ex).__name__)
+            logger.debug("emission of '{}' for '{}' failed - {}".format(service, device_id, ex))
+            self.__on_failure(device_id, service, data)
+            return
+        metrics.events_emitted.inc()
+        latency = time.monotonic() - enqueued
+        self.acknowledged += 1
+        self.latency = latency if self.acknowledged == 1 else self.latency * 0.9 + latency * 0.1
+        self.max_latency = max(self.max_latency, latency)
+
+    def run(self):
+        while True:
+            enqueued, device_id, service, data = self.__take()
+            while len(self.__in_flight) >= self.__max_in_flight:
+                self.__acknowledge()
+            try:
+                future = self.__emit(device_id, service, data)
+            except Exception as ex:
+                self.failed += 1
+                metrics.errors.inc("emission", type(ex).__name__)
+                logger.debug("emission of '{}' for '{}' failed - {}".format(service, device_id, ex))
+                self.__on_failure(device_id, service, data)
+                continue
+            self.__in_flight.append((enqueued, device_id, service, data, future))
+            while self.__in_flight and (not self.__queue or self.__in_flight[0][4].done()):
+                self.__acknowledge()
+
+    @property
+    def depth(self) -> int:
+        return len(self.__queue)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.__in_flight)
@@ -0,0 +1,80 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('HubSynchronizer', )
+
+
+from .logger import root_logger
+from .configuration import config
+from .device_manager import DeviceManager
+from threading import Thread, Condition
+import time, cc_lib
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class HubSynchronizer(Thread):
+    """
+    Collects hub sync requests for 'Discovery.hub_sync_window' seconds and sends a single sync for
+    all of them. cc_lib only syncs complete device lists, so a sync is skipped entirely if the device
+    set and names did not change since the last successful sync (tracked via the pool generation).
+    """
+
+    def __init__(self, device_manager: DeviceManager, client: cc_lib.client.Client):
+        super().__init__(name="hubSynchronizer", daemon=True)
+        self.__device_manager = device_manager
+        self.__client = client
+        self.__cond = Condition()
+        self.__requested = None
+        self.__synced_generation = None
+        self.syncs = 0
+        self.skipped = 0
+
+    def request(self) -> None:
+        with self.__cond:
+            if self.__requested is None:
+                self.__requested = time.monotonic()
+                self.__cond.notify()
+
+    def sync(self) -> bool:
+        generation = self.__device_manager.generation
+        if generation == self.__synced_generation:
+            self.skipped += 1
+            return True
+        try:
+            future = self.__client.syncHub(list(self.__device_manager.devices.values()), asynchronous=True)
+            future.wait()
+            future.result()
+        except (cc_lib.client.HubError, cc_lib.client.NotConnectedError) as ex:
+            logger.warning("hub sync failed - {}".format(ex))
+            return False
+        self.__synced_generation = generation
+        self.syncs += 1
+        return True
+
+    def run(self):
+        while True:
+            with self.__cond:
+                while self.__requested is None:
+                    self.__cond.wait()
+                delay = self.__requested + config.Discovery.hub_sync_window - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.__cond:
+                self.__requested = None
+            if not self.sync():
+                self.request()
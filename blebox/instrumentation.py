@@ -0,0 +1,178 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('metrics', 'MetricsServer')
+
+
+from .logger import root_logger
+from .configuration import config
+from typing import Callable, Iterable
+from threading import Lock, Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bisect import bisect_left
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return str()
+    return "{" + ",".join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.__values = dict()
+        self.__lock = Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def expose(self) -> list:
+        with self.__lock:
+            values = list(self.__values.items())
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        lines.extend("{}{} {}".format(self.name, _labels(self.labels, labels), value) for labels, value in values)
+        return lines
+
+
+class Gauge:
+    """Reports the value returned by a callback at scrape time, or a value set explicitly."""
+
+    def __init__(self, name: str, help: str, callback: Callable[[], float] = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def expose(self) -> list:
+        value = self.value
+        if self.callback:
+            try:
+                value = self.callback()
+            except Exception as ex:
+                logger.debug("gauge '{}' failed - {}".format(self.name, ex))
+                return list()
+        return ["# HELP {} {}".format(self.name, self.help), "# TYPE {} gauge".format(self.name), "{} {}".format(self.name, value)]
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float], labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.__values = dict()
+        self.__lock = Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.__lock:
+            try:
+                entry = self.__values[labels]
+            except KeyError:
+                entry = self.__values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self) -> list:
+        with self.__lock:
+            values = [(labels, list(entry[0]), entry[1], entry[2]) for labels, entry in self.__values.items()]
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} histogram".format(self.name)]
+        names = self.labels + ("le", )
+        for labels, counts, total, observations in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"), ), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(self.name, _labels(names, labels + (le, )), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, _labels(self.labels, labels), total))
+            lines.append("{}_count{} {}".format(self.name, _labels(self.labels, labels), observations))
+        return lines
+
+
+_duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Metrics:
+    """Instruments of the discovery, polling and emission hot paths."""
+
+    def __init__(self):
+        self.discovery_duration = Histogram("blebox_discovery_duration_seconds", "Duration of discovery cycles.", _duration_buckets, ("mode", ))
+        self.hosts_probed = Counter("blebox_hosts_probed_total", "Hosts probed during discovery.")
+        self.hosts_alive = Counter("blebox_hosts_alive_total", "Hosts that answered a discovery probe.")
+        self.hosts_validated = Counter("blebox_hosts_validated_total", "Hosts validated as BleBox devices.")
+        self.evaluate_duration = Histogram("blebox_evaluate_duration_seconds", "Duration of Monitor._evaluate.", _duration_buckets)
+        self.poll_duration = Histogram("blebox_poll_duration_seconds", "Latency of reading polls.", _duration_buckets, ("device", ))
+        self.errors = Counter("blebox_errors_total", "Errors by component and exception class.", ("component", "error"))
+        self.events_emitted = Counter("blebox_events_emitted_total", "Events acknowledged by the client connector.")
+        self.db_write_duration = Histogram("blebox_db_write_duration_seconds", "Duration of batched device database writes.", _duration_buckets)
+        self.__gauges = list()
+
+    def addGauge(self, name: str, help: str, callback: Callable[[], float]) -> None:
+        self.__gauges.append(Gauge(name, help, callback))
+
+    def expose(self) -> str:
+        lines = list()
+        for metric in vars(self).values():
+            if isinstance(metric, (Counter, Histogram)):
+                lines.extend(metric.expose())
+        for gauge in self.__gauges:
+            lines.extend(gauge.expose())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(Thread):
+    """Serves the Prometheus text exposition on 'Metrics.host':'Metrics.port' under /metrics."""
+
+    def __init__(self):
+        super().__init__(name="metricsServer", daemon=True)
+        self.__server = ThreadingHTTPServer((config.Metrics.host, config.Metrics.port), _Handler)
+
+    def run(self):
+        logger.info("serving metrics on {}:{}".format(*self.__server.server_address[:2]))
+        self.__server.serve_forever()
@@ -0,0 +1,100 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('NegativeCache', )
+
+
+from .logger import root_logger
+from .configuration import config
+from threading import Lock
+from sqlite3 import connect as sqlliteConnect
+from os import getcwd, path
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class NegativeCache:
+    """
+    Remembers hosts that turned out not to be BleBox devices. Every further rejection doubles
+    the time a host is skipped, up to 'Discovery.negative_max_ttl'. Entries are keyed by MAC
+    address if known, otherwise by IP, and are persisted so they survive restarts.
+    """
+
+    def __init__(self):
+        self.__entries = dict()
+        self.__dirty = set()
+        self.__lock = Lock()
+        self.__db_path = path.join(getcwd(), "storage/negative_cache.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        with sqlliteConnect(self.__db_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS hosts (key TEXT PRIMARY KEY UNIQUE, expires REAL, strikes INTEGER)")
+            for key, expires, strikes in conn.execute("SELECT key, expires, strikes FROM hosts"):
+                self.__entries[key] = [expires, strikes]
+        conn.close()
+
+    @staticmethod
+    def __key(ip: str, mac: str = None) -> str:
+        return mac.lower() if mac else ip
+
+    def contains(self, ip: str, mac: str = None) -> bool:
+        with self.__lock:
+            entry = self.__entries.get(self.__key(ip, mac))
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def reject(self, ip: str, mac: str = None) -> None:
+        key = self.__key(ip, mac)
+        with self.__lock:
+            entry = self.__entries.setdefault(key, [0, 0])
+            entry[1] += 1
+            ttl = min(config.Discovery.negative_ttl * 2 ** (entry[1] - 1), config.Discovery.negative_max_ttl)
+            entry[0] = time.time() + ttl
+            self.__dirty.add(key)
+
+    def accept(self, ip: str, mac: str = None) -> None:
+        key = self.__key(ip, mac)
+        with self.__lock:
+            if self.__entries.pop(key, None):
+                self.__dirty.add(key)
+
+    def flush(self) -> None:
+        """Persist changed entries and drop entries that expired longer than the maximum TTL ago."""
+        with self.__lock:
+            horizon = time.time() - config.Discovery.negative_max_ttl
+            for key in [key for key, entry in self.__entries.items() if entry[0] < horizon]:
+                del self.__entries[key]
+                self.__dirty.add(key)
+            if not self.__dirty:
+                return
+            upserts = [(key, *self.__entries[key]) for key in self.__dirty if key in self.__entries]
+            deletes = [(key,) for key in self.__dirty if key not in self.__entries]
+            self.__dirty.clear()
+        try:
+            with sqlliteConnect(self.__db_path) as conn:
+                conn.executemany("INSERT OR REPLACE INTO hosts (key, expires, strikes) VALUES (?, ?, ?)", upserts)
+                conn.executemany("DELETE FROM hosts WHERE key=(?)", deletes)
+            conn.close()
+        except Exception as ex:
+            logger.error("could not persist negative cache - {}".format(ex))
+
+    def __len__(self):
+        return len(self.__entries)
@@ -0,0 +1,57 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('readNeighbors', 'orderNeighbors')
+
+
+from .logger import root_logger
+from typing import Iterable
+from ipaddress import IPv4Network, ip_address
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+ARP_TABLE = "/proc/net/arp"
+ATF_COM = 0x2
+
+
+def readNeighbors() -> dict:
+    """Return the complete entries of the kernel neighbor table as a mapping of IP to MAC address."""
+    neighbors = dict()
+    try:
+        with open(ARP_TABLE) as table:
+            next(table, None)
+            for line in table:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                ip, _, flags, mac = fields[:4]
+                if int(flags, 16) & ATF_COM and mac != "00:00:00:00:00:00":
+                    neighbors[ip] = mac.lower()
+    except (OSError, ValueError) as ex:
+        logger.debug("can't read neighbor table - {}".format(ex))
+    return neighbors
+
+
+def orderNeighbors(neighbors: dict, networks: Iterable[IPv4Network], ouis: Iterable[str] = ()) -> list:
+    """Return neighbors inside the given networks, hosts with a preferred MAC OUI first."""
+    networks = list(networks)
+    ouis = tuple(oui.strip().lower() for oui in ouis if oui.strip())
+    candidates = [ip for ip in neighbors if any(ip_address(ip) in network for network in networks)]
+    if ouis:
+        candidates.sort(key=lambda ip: not neighbors[ip].startswith(ouis))
+    return candidates
@@ -0,0 +1,152 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('Outbox', )
+
+
+from .logger import root_logger
+from .configuration import config
+from typing import Callable
+from threading import Thread, Lock
+from queue import Queue, Empty
+from sqlite3 import connect as sqlliteConnect
+from os import getcwd, path
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class Outbox:
+    """
+    Disk-backed store for events that could not be emitted. Holds at most 'Outbox.max_size' events;
+    when full either the oldest ('drop-oldest') or the incoming event ('drop-newest') is discarded.
+    Stored payloads keep their original reading timestamp. Events are written behind in batched
+    transactions like device changes, see 'Storage.batch_size' and 'Storage.batch_delay'.
+    """
+
+    def __init__(self, name: str = "outbox"):
+        self.__lock = Lock()
+        self.__replay_lock = Lock()
+        self.__db_path = path.join(getcwd(), "storage/{}.sqlite3".format(name))
+        self.__conn = sqlliteConnect(self.__db_path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        with self.__conn:
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT, service TEXT, data TEXT)")
+        self.__size = self.__conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        self.__pending = 0
+        self.__write_queue = Queue()
+        self.evicted = 0
+        self.__writer = Thread(target=self.__writeBehind, name="outboxWriter", daemon=True)
+        self.__writer.start()
+
+    def __writeBehind(self):
+        """Insert queued events in batched transactions and evict the oldest events beyond 'Outbox.max_size'."""
+        while True:
+            batch = [self.__write_queue.get()]
+            deadline = time.monotonic() + config.Storage.batch_delay
+            while len(batch) < config.Storage.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.__write_queue.get(timeout=timeout))
+                except Empty:
+                    break
+            try:
+                with self.__lock:
+                    self.__pending -= len(batch)
+                    with self.__conn:
+                        inserted = self.__conn.executemany("INSERT INTO events (device_id, service, data) VALUES (?, ?, ?)", batch).rowcount
+                        evicted = 0
+                        excess = self.__size + inserted - config.Outbox.max_size
+                        if excess > 0:
+                            evicted = self.__conn.execute(
+                                "DELETE FROM events WHERE seq IN (SELECT seq FROM events ORDER BY seq LIMIT ?)", (excess, )
+                            ).rowcount
+                    self.__size += inserted - evicted
+                    self.evicted += evicted
+            except Exception as ex:
+                logger.error("could not store {} event(s) - {}".format(len(batch), ex))
+            finally:
+                for _ in batch:
+                    self.__write_queue.task_done()
+
+    def put(self, device_id: str, service: str, data: str) -> None:
+        with self.__lock:
+            if config.Outbox.policy == "drop-newest" and self.__size + self.__pending >= config.Outbox.max_size:
+                self.evicted += 1
+                return
+            self.__pending += 1
+        self.__write_queue.put((device_id, service, data))
+
+    def flush(self) -> None:
+        """Block until all queued events are stored."""
+        self.__write_queue.join()
+
+    def replay(self, emit: Callable[[str, str, str], object]) -> int:
+        """
+        Hand stored events to 'emit' in batches of 'Outbox.batch_size', paced to 'Outbox.replay_rate'
+        events per second. 'emit' returns a cc_lib future; events are removed once their future
+        succeeded. Replay stops at the first failure and returns the number of replayed events.
+        """
+        if not self.__replay_lock.acquire(blocking=False):
+            return 0
+        replayed = 0
+        try:
+            while True:
+                with self.__lock:
+                    batch = self.__conn.execute(
+                        "SELECT seq, device_id, service, data FROM events ORDER BY seq LIMIT ?", (config.Outbox.batch_size,)
+                    ).fetchall()
+                if not batch:
+                    break
+                start = time.monotonic()
+                futures = list()
+                failed = False
+                for seq, device_id, service, data in batch:
+                    try:
+                        futures.append((seq, emit(device_id, service, data)))
+                    except Exception as ex:
+                        logger.warning("outbox replay interrupted - {}".format(ex))
+                        failed = True
+                        break
+                done = list()
+                for seq, future in futures:
+                    future.wait()
+                    try:
+                        future.result()
+                        done.append((seq,))
+                    except Exception:
+                        failed = True
+                with self.__lock:
+                    with self.__conn:
+                        # events evicted by put() meanwhile are already gone and must not be counted twice
+                        self.__size -= self.__conn.executemany("DELETE FROM events WHERE seq=(?)", done).rowcount
+                replayed += len(done)
+                if failed:
+                    break
+                if config.Outbox.replay_rate > 0:
+                    time.sleep(max(0.0, len(batch) / config.Outbox.replay_rate - (time.monotonic() - start)))
+        finally:
+            self.__replay_lock.release()
+        if replayed:
+            logger.info("replayed {} stored event(s), {} remaining".format(replayed, len(self)))
+        return replayed
+
+    def __len__(self):
+        return self.__size + self.__pending
@@ -0,0 +1,149 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('ReadingPoller', )
+
+
+from .logger import root_logger
+from .configuration import config
+from .session_pool import http_pool, DeadlineExceeded
+from .breaker import circuit_breaker
+from .profiling import profiled
+from .instrumentation import metrics
+from .device_manager import DeviceManager
+from .device import device_type_map
+from .scheduler import PollScheduler
+from .reachability import ReachabilityTracker
+from .sharding import ShardCoordinator
+from typing import Callable, Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests import exceptions
+import time, json, cc_lib
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+def parseIntervals(value) -> dict:
+    intervals = dict()
+    for item in str(value or str()).split(','):
+        key, _, interval = item.strip().rpartition(':')
+        if key:
+            try:
+                intervals[key] = float(interval)
+            except ValueError:
+                logger.error("invalid polling interval '{}'".format(item))
+    return intervals
+
+
+class ReadingPoller:
+    """
+    Fetches air sensor states from many devices in parallel. Every request, from connect to the
+    last byte of the body, is aborted after 'Polling.timeout' seconds, so a slow device holds a
+    worker no longer than that. Successful readings are handed to 'on_reading' right away.
+    """
+
+    def __init__(self, device_manager: DeviceManager, on_reading: Callable[[cc_lib.types.Device, dict], None], reachability: ReachabilityTracker = None, shard: ShardCoordinator = None):
+        self.__device_manager = device_manager
+        self.__shard = shard
+        self.__on_reading = on_reading
+        self.__reachability = reachability
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, config.Polling.workers), thread_name_prefix="pollWorker")
+        self.__scheduler = PollScheduler()
+        self.__in_flight = set()
+        self.__known = set()
+        self.__type_names = {d_type: name for name, d_type in device_type_map.items()}
+        self.__type_intervals = parseIntervals(config.Polling.type_intervals)
+        self.__device_intervals = parseIntervals(config.Polling.device_intervals)
+
+    def interval(self, device: cc_lib.types.Device) -> float:
+        try:
+            return self.__device_intervals[device.id]
+        except KeyError:
+            return self.__type_intervals.get(self.__type_names.get(type(device)), config.Polling.interval)
+
+    @profiled("pushReadings")
+    def _poll(self, device: cc_lib.types.Device) -> None:
+        if not circuit_breaker.allow(device.ip):
+            return
+        deadline = config.Polling.timeout
+        start = time.monotonic()
+        success = False
+        try:
+            status, body = http_pool.fetch(device.ip, config.Api.air_sensor_state, deadline)
+            metrics.poll_duration.observe(time.monotonic() - start, device.id if config.Metrics.per_device else "all")
+            if status == 200:
+                success = True
+                circuit_breaker.success(device.ip)
+                self.__on_reading(device, json.loads(body))
+            elif circuit_breaker.failure(device.ip):
+                logger.error("reading of '{}' failed with status {}".format(device.ip, status))
+        except DeadlineExceeded:
+            metrics.errors.inc("poll", "DeadlineExceeded")
+            if circuit_breaker.failure(device.ip):
+                logger.warning("reading of '{}' exceeded deadline of {}s".format(device.ip, deadline))
+        except exceptions.RequestException as ex:
+            metrics.errors.inc("poll", type(ex).__name__)
+            if circuit_breaker.failure(device.ip):
+                logger.error("could not send request to '{}'".format(device.ip))
+        except Exception as ex:
+            metrics.errors.inc("poll", type(ex).__name__)
+            logger.error(ex)
+        if self.__reachability:
+            self.__reachability.report(device, success)
+
+    def poll(self, devices: Iterable[cc_lib.types.Device]):
+        return [self.__executor.submit(self._poll, device) for device in devices]
+
+    def __done(self, device_id: str):
+        self.__in_flight.discard(device_id)
+
+    def __owned(self) -> Mapping[str, cc_lib.types.Device]:
+        devices = self.__device_manager.devices
+        if not self.__shard:
+            return devices
+        return {device_id: device for device_id, device in devices.items() if self.__shard.owns(device_id)}
+
+    def __syncSchedule(self, devices: Mapping[str, cc_lib.types.Device]):
+        for device_id, device in devices.items():
+            self.__scheduler.schedule(device_id, self.interval(device))
+        if len(self.__scheduler) > len(devices):
+            for device_id in [device_id for device_id in self.__known if device_id not in devices]:
+                self.__scheduler.remove(device_id)
+        self.__known = set(devices)
+
+    def run(self) -> None:
+        """Poll every device on its own schedule instead of in fleet-wide sweeps."""
+        generation = None
+        while True:
+            current_generation = (self.__device_manager.generation, self.__shard.generation if self.__shard else 0)
+            if current_generation != generation:
+                generation = current_generation
+                devices = self.__owned()
+                self.__syncSchedule(devices)
+            for device_id in self.__scheduler.due(timeout=1):
+                self.__scheduler.reschedule(device_id)
+                device = devices.get(device_id)
+                if not device or not device.reachable or device_id in self.__in_flight:
+                    continue
+                self.__in_flight.add(device_id)
+                future = self.__executor.submit(self._poll, device)
+                future.add_done_callback(lambda f, device_id=device_id: self.__done(device_id))
+
+    def sweep(self) -> None:
+        futures = self.poll(device for device in self.__owned().values() if device.reachable)
+        if futures:
+            wait(futures)
@@ -0,0 +1,169 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('probeHosts', )
+
+
+from .logger import root_logger
+from .instrumentation import metrics
+from .profiling import profiled
+from typing import Iterable, Iterator
+from threading import Thread, Event
+from queue import Queue
+from os import getpid
+import asyncio, socket, struct
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!{}H'.format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class _IcmpProber:
+    """Sends ICMP echo requests over a single raw socket and matches replies by sequence number."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.__loop = loop
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self.__sock.setblocking(False)
+        self.__id = getpid() & 0xFFFF
+        self.__seq = 0
+        self.__pending = dict()
+        loop.add_reader(self.__sock, self.__onReadable)
+
+    def __onReadable(self):
+        while True:
+            try:
+                data, _ = self.__sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            offset = (data[0] & 0x0F) * 4
+            if len(data) < offset + 8:
+                continue
+            icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', data[offset:offset + 8])
+            if icmp_type == 0 and ident == self.__id:
+                future = self.__pending.pop(seq, None)
+                if future and not future.done():
+                    future.set_result(True)
+
+    async def probe(self, host: str, timeout: float) -> bool:
+        self.__seq = (self.__seq + 1) & 0xFFFF
+        seq = self.__seq
+        header = struct.pack('!BBHHH', 8, 0, 0, self.__id, seq)
+        packet = struct.pack('!BBHHH', 8, 0, _checksum(header), self.__id, seq)
+        future = self.__loop.create_future()
+        self.__pending[seq] = future
+        try:
+            self.__sock.sendto(packet, (host, 0))
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, OSError):
+            return False
+        finally:
+            self.__pending.pop(seq, None)
+
+    def close(self):
+        self.__loop.remove_reader(self.__sock)
+        self.__sock.close()
+
+
+async def _tcpProbe(host: str, port: int, timeout: float) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (asyncio.TimeoutError, OSError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def _sweep(hosts: Iterator[str], port: int, concurrency: int, timeout: float, icmp: bool, rate: float, results: Queue, stop: Event):
+    loop = asyncio.get_running_loop()
+    next_slot = loop.time()
+    icmp_prober = None
+    if icmp:
+        try:
+            icmp_prober = _IcmpProber(loop)
+        except PermissionError:
+            logger.warning("raw ICMP requires elevated privileges - falling back to TCP probes")
+
+    async def pace():
+        nonlocal next_slot
+        now = loop.time()
+        slot = max(now, next_slot)
+        next_slot = slot + 1 / rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def worker():
+        for host in hosts:
+            if stop.is_set():
+                return
+            if rate > 0:
+                await pace()
+            if icmp_prober:
+                alive = await icmp_prober.probe(host, timeout)
+            else:
+                alive = await _tcpProbe(host, port, timeout)
+            metrics.hosts_probed.inc()
+            if alive:
+                metrics.hosts_alive.inc()
+                results.put(host)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        if icmp_prober:
+            icmp_prober.close()
+
+
+def probeHosts(hosts: Iterable[str], port: int, concurrency: int, timeout: float, icmp: bool = False, rate: float = 0) -> Iterator[str]:
+    """
+    Probe hosts with non-blocking TCP connects (or ICMP echo if requested and privileged) and yield
+    every responding host as soon as it answers. 'rate' limits the probes started per second (0 = unlimited)
+    and 'hosts' is consumed lazily. Closing the generator stops the sweep.
+    """
+    results = Queue()
+    stop = Event()
+
+    @profiled("discoverHosts")
+    def run():
+        try:
+            asyncio.run(_sweep(iter(hosts), port, concurrency, timeout, icmp, rate, results, stop))
+        except Exception as ex:
+            logger.error("host probe failed - {}".format(ex))
+        finally:
+            results.put(None)
+
+    sweep_thread = Thread(target=run, name="probeHosts", daemon=True)
+    sweep_thread.start()
+    try:
+        while True:
+            host = results.get()
+            if host is None:
+                break
+            yield host
+    finally:
+        stop.set()
@@ -0,0 +1,177 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('profiler', 'profiled')
+
+
+from .logger import root_logger
+from .configuration import config
+from typing import Callable
+from threading import Thread, Timer, Event, Lock, current_thread, get_ident
+from collections import Counter
+from functools import wraps
+from os import getcwd, makedirs, path
+import sys, tracemalloc, signal, time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class Profiler:
+    """
+    Sampling profiler for functions decorated with 'profiled'. While active, a sampler thread reads
+    the stacks of all threads every 'Profiling.sample_interval' seconds via sys._current_frames()
+    and counts them under the name of the profiled call the thread is in. Calls nested in a profiled
+    call of the same thread are accounted to the outer name. If 'Profiling.tracemalloc' is set a
+    memory snapshot is taken as well. stop() writes per name a '<name>.folded' file of collapsed
+    stacks (flame graph input) and a '<name>.txt' summary of the functions with the most samples,
+    plus the memory snapshot, to 'storage/profiles/<start time>/'. Sampling works alike on all
+    Python versions, unlike cProfile, which allows a single active profiler per interpreter from
+    3.12 on. While inactive a profiled call costs one attribute lookup.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.__lock = Lock()
+        self.__regions = dict()
+        self.__samples = dict()
+        self.__sampler = None
+        self.__stop = Event()
+        self.__started = None
+        self.__timer = None
+
+    def start(self) -> None:
+        with self.__lock:
+            if self.active:
+                return
+            self.__samples = dict()
+            self.__started = time.strftime("%Y%m%d-%H%M%S")
+            if config.Profiling.tracemalloc and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if config.Profiling.duration > 0:
+                self.__timer = Timer(config.Profiling.duration, self.stop)
+                self.__timer.daemon = True
+                self.__timer.start()
+            self.__stop = Event()
+            self.__sampler = Thread(target=self.__sample, args=(self.__stop, ), name="profilerSampler", daemon=True)
+            self.active = True
+            self.__sampler.start()
+        logger.info("profiling started")
+
+    def stop(self):
+        """Stop collecting and write the results. Returns the output directory or None if inactive."""
+        with self.__lock:
+            if not self.active:
+                return None
+            self.active = False
+            self.__stop.set()
+            sampler = self.__sampler
+            self.__sampler = None
+            if self.__timer:
+                self.__timer.cancel()
+                self.__timer = None
+        if sampler is not current_thread():
+            sampler.join()
+        samples = self.__samples
+        snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        directory = path.join(getcwd(), "storage/profiles", self.__started)
+        makedirs(directory, exist_ok=True)
+        for name, stacks in samples.items():
+            self.__write(directory, name, stacks)
+        if snapshot:
+            snapshot.dump(path.join(directory, "memory.tracemalloc"))
+            with open(path.join(directory, "memory.txt"), "w") as file:
+                for statistic in snapshot.statistics("lineno")[:50]:
+                    file.write("{}\n".format(statistic))
+        logger.info("profiling stopped - results written to '{}'".format(directory))
+        return directory
+
+    def toggle(self) -> None:
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def __sample(self, stop: Event) -> None:
+        own_id = get_ident()
+        while not stop.wait(config.Profiling.sample_interval):
+            regions = self.__regions
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = regions.get(thread_id)
+                if name is None:
+                    continue
+                stack = list()
+                while frame is not None and len(stack) < 128:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                stacks = self.__samples.setdefault(name, Counter())
+                stacks[";".join(stack)] += 1
+
+    @staticmethod
+    def __write(directory: str, name: str, stacks: Counter) -> None:
+        total = sum(stacks.values())
+        own = Counter()
+        cumulative = Counter()
+        with open(path.join(directory, "{}.folded".format(name)), "w") as file:
+            for stack, samples in stacks.most_common():
+                file.write("{} {}\n".format(stack, samples))
+                functions = stack.split(";")
+                own[functions[-1]] += samples
+                for function in set(functions):
+                    cumulative[function] += samples
+        with open(path.join(directory, "{}.txt".format(name)), "w") as file:
+            file.write("{} samples\n\nown samples\n".format(total))
+            for function, samples in own.most_common(30):
+                file.write("{:>8} {:6.1%}  {}\n".format(samples, samples / total, function))
+            file.write("\ncumulative samples\n")
+            for function, samples in cumulative.most_common(30):
+                file.write("{:>8} {:6.1%}  {}\n".format(samples, samples / total, function))
+
+    def call(self, name: str, func: Callable, *args, **kwargs):
+        thread_id = get_ident()
+        if thread_id in self.__regions:
+            return func(*args, **kwargs)
+        self.__regions[thread_id] = name
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del self.__regions[thread_id]
+
+    def installSignalHandler(self, signum: int = signal.SIGUSR1) -> None:
+        """Toggle profiling on 'signum'. Must be called from the main thread."""
+        signal.signal(signum, lambda *args: Thread(target=self.toggle, name="profilerToggle", daemon=True).start())
+
+
+profiler = Profiler()
+
+
+def profiled(name: str) -> Callable:
+    """Profile calls of the decorated function under 'name' while the profiler is active."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.active:
+                return func(*args, **kwargs)
+            return profiler.call(name, func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,67 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('ReachabilityTracker', )
+
+
+from .logger import root_logger
+from .configuration import config
+from typing import Callable
+from threading import Lock
+import cc_lib
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class ReachabilityTracker:
+    """
+    Per-device reachability with hysteresis. A reachable device is only considered lost after
+    'Reachability.failure_threshold' consecutive failed checks and a lost device only recovers after
+    'Reachability.recovery_threshold' consecutive successful ones. Discovery results and reading
+    polls both report here; listeners are called on every transition.
+    """
+
+    def __init__(self):
+        self.__states = dict()
+        self.__lock = Lock()
+        self.__listeners = list()
+
+    def addListener(self, func: Callable[[cc_lib.types.Device, bool], None]) -> None:
+        self.__listeners.append(func)
+
+    def report(self, device: cc_lib.types.Device, success: bool):
+        """Record a check result. Returns the new reachability on a transition, otherwise None."""
+        with self.__lock:
+            try:
+                state = self.__states[device.id]
+            except KeyError:
+                state = self.__states[device.id] = [device.reachable, 0]
+            if success == state[0]:
+                state[1] = 0
+                return None
+            state[1] += 1
+            threshold = config.Reachability.recovery_threshold if success else config.Reachability.failure_threshold
+            if state[1] < max(1, threshold):
+                return None
+            state[0] = success
+            state[1] = 0
+        for listener in self.__listeners:
+            try:
+                listener(device, success)
+            except Exception as ex:
+                logger.error("reachability listener failed - {}".format(ex))
+        return success
@@ -0,0 +1,147 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('DeadbandFilter', 'WindowAggregator')
+
+
+from .logger import root_logger
+from typing import Iterable
+from array import array
+from math import isnan
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+NaN = float("nan")
+
+
+def _number(value: float):
+    """Whole numbers as int, so integer readings keep their JSON representation."""
+    return int(value) if value.is_integer() else value
+
+
+class DeadbandFilter:
+    """
+    Decides per device and service whether a reading differs enough from the last reported one.
+    A reading passes if it is the first one, if it moved by more than the absolute deadband or
+    the relative deadband (fraction of the last reported value), or if 'heartbeat' seconds passed
+    since the last report. State per device is one flat array of (value, time) pairs.
+    """
+
+    def __init__(self, services: Iterable[str], absolute: float = 0.0, relative: float = 0.0, heartbeat: float = 0.0):
+        self.__slots = {service: index * 2 for index, service in enumerate(dict.fromkeys(services))}
+        self.__empty = array('d', (NaN, ) * 2 * len(self.__slots))
+        self.__absolute = absolute
+        self.__relative = relative
+        self.__heartbeat = heartbeat
+        self.__state = dict()
+
+    def accept(self, device_id: str, service: str, value: float, now: float = None) -> bool:
+        try:
+            slot = self.__slots[service]
+        except KeyError:
+            return True
+        try:
+            state = self.__state[device_id]
+        except KeyError:
+            state = self.__state.setdefault(device_id, array('d', self.__empty))
+        if now is None:
+            now = time.monotonic()
+        last_value = state[slot]
+        if not isnan(last_value):
+            delta = abs(value - last_value)
+            threshold = max(self.__absolute, self.__relative * abs(last_value))
+            heartbeat_due = self.__heartbeat > 0 and now - state[slot + 1] >= self.__heartbeat
+            if not heartbeat_due and (delta <= threshold if threshold > 0 else delta == 0):
+                return False
+        state[slot] = value
+        state[slot + 1] = now
+        return True
+
+    def __len__(self):
+        return len(self.__state)
+
+
+class WindowAggregator:
+    """
+    Collects readings per device and service over windows of 'window' seconds and reduces them to
+    min, max, mean and last. Every device holds one fixed-size array('d') with a ring buffer of
+    'capacity' samples per service, so memory per device does not depend on the poll rate. If more
+    than 'capacity' samples arrive within a window only the latest 'capacity' ones are aggregated.
+    'value' names the statistic reported as the reading value.
+    """
+
+    statistics = ("min", "max", "mean", "last")
+
+    def __init__(self, services: Iterable[str], window: float, capacity: int, value: str = "mean"):
+        if value not in self.statistics:
+            logger.warning("unknown aggregation value '{}' - using 'mean'".format(value))
+            value = "mean"
+        self.value = value
+        self.__slots = {service: index for index, service in enumerate(dict.fromkeys(services))}
+        self.__window = window
+        self.__capacity = max(1, capacity)
+        self.__empty = array('d', (0.0, ) * self.__capacity * len(self.__slots))
+        self.__no_counts = array('L', (0, ) * len(self.__slots))
+        self.__state = dict()
+
+    def add(self, device_id: str, service: str, value: float, now: float = None) -> bool:
+        try:
+            slot = self.__slots[service]
+        except KeyError:
+            return False
+        try:
+            state = self.__state[device_id]
+        except KeyError:
+            state = self.__state.setdefault(
+                device_id, [time.monotonic() if now is None else now, array('d', self.__empty), array('L', self.__no_counts)]
+            )
+        samples, counts = state[1], state[2]
+        samples[slot * self.__capacity + counts[slot] % self.__capacity] = value
+        counts[slot] += 1
+        return True
+
+    def collect(self, device_id: str, now: float = None) -> dict:
+        """Aggregates per service if the device's current window elapsed, otherwise an empty dict."""
+        state = self.__state.get(device_id)
+        if now is None:
+            now = time.monotonic()
+        if state is None or now - state[0] < self.__window:
+            return dict()
+        samples, counts = state[1], state[2]
+        aggregates = dict()
+        for service, slot in self.__slots.items():
+            count = counts[slot]
+            if not count:
+                continue
+            start = slot * self.__capacity
+            size = min(count, self.__capacity)
+            values = samples[start:start + size]
+            aggregates[service] = {
+                "min": _number(min(values)),
+                "max": _number(max(values)),
+                "mean": _number(sum(values) / size),
+                "last": _number(samples[start + (count - 1) % self.__capacity]),
+                "count": count
+            }
+            counts[slot] = 0
+        state[0] = now
+        return aggregates
+
+    def __len__(self):
+        return len(self.__state)
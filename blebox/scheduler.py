@@ -0,0 +1,104 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('PollScheduler', )
+
+
+from threading import Condition
+from zlib import crc32
+from heapq import heappush, heappop
+import time
+
+
+class PollScheduler:
+    """
+    Keeps a next-due time per device in a heap. New devices get a stable phase offset derived
+    from their id, so polls are spread across the interval instead of arriving in bursts.
+    Scheduling, rescheduling and popping a due device are O(log n); removals are lazy.
+    """
+
+    def __init__(self):
+        self.__heap = list()
+        self.__entries = dict()
+        self.__intervals = dict()
+        self.__cond = Condition()
+
+    @staticmethod
+    def phase(key: str) -> float:
+        return crc32(key.encode()) / 0x100000000
+
+    def __push(self, key: str, due: float):
+        entry = [due, key, True]
+        self.__entries[key] = entry
+        heappush(self.__heap, entry)
+
+    def schedule(self, key: str, interval: float) -> None:
+        with self.__cond:
+            if key in self.__entries:
+                if self.__intervals[key] == interval:
+                    return
+                self.__entries[key][2] = False
+            self.__intervals[key] = interval
+            self.__push(key, time.monotonic() + self.phase(key) * interval)
+            self.__cond.notify()
+
+    def remove(self, key: str) -> None:
+        with self.__cond:
+            entry = self.__entries.pop(key, None)
+            if entry:
+                entry[2] = False
+                del self.__intervals[key]
+
+    def reschedule(self, key: str) -> None:
+        with self.__cond:
+            entry = self.__entries.get(key)
+            if not entry or entry[2]:
+                return
+            interval = self.__intervals[key]
+            now = time.monotonic()
+            due = entry[0] + interval
+            if due <= now:
+                due = now + interval
+            self.__push(key, due)
+
+    def due(self, timeout: float) -> list:
+        """Wait up to 'timeout' seconds and return the keys that are due. Returned keys must be rescheduled."""
+        keys = list()
+        with self.__cond:
+            end = time.monotonic() + timeout
+            while True:
+                while self.__heap and not self.__heap[0][2]:
+                    heappop(self.__heap)
+                now = time.monotonic()
+                if self.__heap and self.__heap[0][0] <= now:
+                    while self.__heap and self.__heap[0][0] <= now:
+                        entry = heappop(self.__heap)
+                        if entry[2]:
+                            entry[2] = False
+                            keys.append(entry[1])
+                    return keys
+                if now >= end:
+                    return keys
+                wait = end - now
+                if self.__heap:
+                    wait = min(wait, self.__heap[0][0] - now)
+                self.__cond.wait(wait)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
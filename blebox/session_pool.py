@@ -0,0 +1,222 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('http_pool', 'DeadlineExceeded')
+
+
+from .logger import root_logger
+from .configuration import config
+from threading import Lock, Timer, local
+from socket import SHUT_RDWR
+from typing import Tuple
+from requests import Session, Response
+from requests.adapters import HTTPAdapter
+from requests import exceptions
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+class DeadlineExceeded(exceptions.Timeout):
+    pass
+
+
+class _Watchdog:
+    """Shuts down the socket of the request it is attached to once 'deadline' seconds passed."""
+
+    def __init__(self, deadline: float):
+        self.__lock = Lock()
+        self.__sock = None
+        self.__done = False
+        self.expired = False
+        self.__timer = Timer(deadline, self.__expire)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __shutdown(self):
+        try:
+            self.__sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __expire(self):
+        with self.__lock:
+            if self.__done:
+                return
+            self.expired = True
+            if self.__sock is not None:
+                self.__shutdown()
+
+    def attach(self, sock) -> None:
+        with self.__lock:
+            self.__sock = sock
+            if self.expired:
+                self.__shutdown()
+
+    def cancel(self) -> None:
+        with self.__lock:
+            self.__done = True
+        self.__timer.cancel()
+
+
+_watched = local()
+
+
+def _watch(sock) -> None:
+    watchdog = getattr(_watched, "watchdog", None)
+    if watchdog is not None and sock is not None:
+        watchdog.attach(sock)
+
+
+class _WatchedConnection(HTTPConnection):
+    """Hands its socket to the watchdog of the request running in the current thread, if any."""
+
+    def connect(self):
+        super().connect()
+        _watch(self.sock)
+
+    def request(self, *args, **kwargs):
+        _watch(self.sock)
+        return super().request(*args, **kwargs)
+
+
+class _WatchedConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _WatchedConnection
+
+
+class HostSessionPool:
+    """
+    Keeps one keep-alive session per device host so discovery and reading polls reuse
+    TCP connections. Sessions idle for longer than 'idle_timeout' seconds are closed.
+    """
+
+    def __init__(self, pool_size: int, idle_timeout: float):
+        self.__pool_size = max(1, pool_size)
+        self.__idle_timeout = idle_timeout
+        self.__sessions = dict()
+        self.__lock = Lock()
+        self.__last_eviction = time.monotonic()
+        self.__closed_connections = 0
+        self.__closed_requests = 0
+
+    def __newSession(self) -> tuple:
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.__pool_size, max_retries=0)
+        adapter.poolmanager.pool_classes_by_scheme = dict(adapter.poolmanager.pool_classes_by_scheme, http=_WatchedConnectionPool)
+        session.mount("http://", adapter)
+        return session, adapter
+
+    def __session(self, host: str) -> Session:
+        now = time.monotonic()
+        with self.__lock:
+            try:
+                entry = self.__sessions[host]
+            except KeyError:
+                entry = [*self.__newSession(), now]
+                self.__sessions[host] = entry
+            entry[2] = now
+            session = entry[0]
+        if self.__idle_timeout > 0 and now - self.__last_eviction > self.__idle_timeout:
+            self.evictIdle()
+        return session
+
+    def __close(self, entry: list):
+        connections, requests = self.__adapterStats(entry[1])
+        self.__closed_connections += connections
+        self.__closed_requests += requests
+        entry[0].close()
+
+    @staticmethod
+    def __adapterStats(adapter: HTTPAdapter) -> tuple:
+        connections = 0
+        requests = 0
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            connections += pool.num_connections
+            requests += pool.num_requests
+        return connections, requests
+
+    def get(self, host: str, path: str, timeout=None) -> Response:
+        return self.__session(host).get(
+            url="http://{}:{}/{}".format(host, config.Api.port, path),
+            timeout=timeout
+        )
+
+    def fetch(self, host: str, path: str, deadline: float) -> Tuple[int, bytes]:
+        """
+        GET 'path' and return status code and body within 'deadline' seconds in total. requests
+        only bounds single socket operations, so a watchdog shuts the connection's socket down when
+        the deadline passes, whichever phase the request is in, and DeadlineExceeded is raised.
+        """
+        watchdog = _Watchdog(deadline)
+        _watched.watchdog = watchdog
+        try:
+            response = self.__session(host).get(
+                url="http://{}:{}/{}".format(host, config.Api.port, path),
+                timeout=deadline
+            )
+        except exceptions.RequestException:
+            if watchdog.expired:
+                raise DeadlineExceeded("response of '{}' exceeded deadline of {}s".format(host, deadline))
+            raise
+        finally:
+            _watched.watchdog = None
+            watchdog.cancel()
+        if watchdog.expired:
+            # the socket may have been shut down after the connection went back to the pool
+            self.release(host)
+            raise DeadlineExceeded("response of '{}' exceeded deadline of {}s".format(host, deadline))
+        return response.status_code, response.content
+
+    def release(self, host: str) -> None:
+        with self.__lock:
+            entry = self.__sessions.pop(host, None)
+            if entry:
+                self.__close(entry)
+
+    def evictIdle(self) -> None:
+        now = time.monotonic()
+        with self.__lock:
+            self.__last_eviction = now
+            for host in [host for host, entry in self.__sessions.items() if now - entry[2] > self.__idle_timeout]:
+                self.__close(self.__sessions.pop(host))
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Share of requests that were sent over an already established connection."""
+        with self.__lock:
+            connections = self.__closed_connections
+            requests = self.__closed_requests
+            for entry in self.__sessions.values():
+                c, r = self.__adapterStats(entry[1])
+                connections += c
+                requests += r
+        if not requests:
+            return 0.0
+        return max(0.0, 1 - connections / requests)
+
+    def __len__(self):
+        return len(self.__sessions)
+
+
+http_pool = HostSessionPool(config.Http.pool_size, config.Http.idle_timeout)
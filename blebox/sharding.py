@@ -0,0 +1,167 @@
+"""
+   Copyright 2019 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ('ShardCoordinator', )
+
+
+from .logger import root_logger
+from .configuration import config
+from typing import Callable, Iterable
+from threading import Thread, Event, Lock
+from sqlite3 import connect as sqlliteConnect
+from hashlib import md5
+from bisect import bisect
+from socket import gethostname
+from os import getcwd, path
+import time
+
+
+logger = root_logger.getChild(__name__.split(".", 1)[-1])
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(md5(key.encode()).digest()[:8], "big")
+
+
+def _hostId() -> str:
+    """Identify the kernel this process runs on, which containers of one host share."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as file:
+            return file.read().strip()
+    except OSError:
+        return gethostname()
+
+
+class HashRing:
+    """Consistent hash ring with 'replicas' virtual nodes per member."""
+
+    def __init__(self, members: Iterable[str], replicas: int):
+        points = sorted((_hash("{}#{}".format(member, replica)), member) for member in members for replica in range(max(1, replicas)))
+        self.__hashes = [point[0] for point in points]
+        self.__members = [point[1] for point in points]
+
+    def owner(self, key: str):
+        if not self.__hashes:
+            return None
+        return self.__members[bisect(self.__hashes, _hash(key)) % len(self.__members)]
+
+
+class ShardCoordinator(Thread):
+    """
+    Registers this worker in 'storage/workers.sqlite3', which all workers of a deployment share, and
+    renews a heartbeat every 'Sharding.heartbeat_interval' seconds. Workers without a heartbeat for
+    'Sharding.heartbeat_timeout' seconds are removed. Devices are assigned to the live workers by
+    consistent hashing of their id, so a joining or leaving worker only moves its share of devices.
+    The longest registered worker is the leader and runs discovery for everyone. The worker id names
+    the worker's outbox as well and must therefore be stable, so a restarted worker replays the
+    events it stored before.
+    All workers must run on one host from the same working directory: the shared databases use WAL,
+    which needs shared memory and does not work on network filesystems, so a worker refuses to join
+    while live workers of another host are registered. The workers also share the cc_lib hub identity
+    in 'cc-lib/'. Only the leader syncs the hub, but every worker opens its own broker connection
+    with that identity, so the broker must accept concurrent connections of one hub.
+    """
+
+    def __init__(self, worker_id: str = None):
+        super().__init__(name="shardCoordinator", daemon=True)
+        self.worker_id = worker_id or config.Sharding.worker_id
+        self.__db_path = path.join(getcwd(), "storage/workers.sqlite3")
+        self.__conn = sqlliteConnect(self.__db_path, check_same_thread=False, timeout=config.Sharding.heartbeat_interval)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        with self.__conn:
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY UNIQUE, joined REAL, heartbeat REAL)")
+            if "host" not in {row[1] for row in self.__conn.execute("PRAGMA table_info(workers)")}:
+                self.__conn.execute("ALTER TABLE workers ADD COLUMN host TEXT")
+        self.__host = _hostId()
+        foreign = [
+            row[0] for row in self.__conn.execute(
+                "SELECT id FROM workers WHERE host != ? AND heartbeat >= ?", (self.__host, time.time() - config.Sharding.heartbeat_timeout)
+            )
+        ]
+        if foreign:
+            raise Exception("workers {} run on another host - sharding supports workers on a single host only".format(", ".join(foreign)))
+        self.__lock = Lock()
+        self.__members = tuple()
+        self.__ring = HashRing(self.__members, config.Sharding.replicas)
+        self.__stop = Event()
+        self.__listeners = list()
+        self.__connected = set()
+        self.generation = 0
+        self.heartbeat()
+
+    def addListener(self, func: Callable[[], None]) -> None:
+        """Call 'func' after every rebalance."""
+        self.__listeners.append(func)
+
+    def heartbeat(self) -> None:
+        now = time.time()
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute(
+                    "INSERT INTO workers (id, joined, heartbeat, host) VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET heartbeat=excluded.heartbeat, host=excluded.host",
+                    (self.worker_id, now, now, self.__host)
+                )
+                self.__conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - config.Sharding.heartbeat_timeout, ))
+                members = tuple(row[0] for row in self.__conn.execute("SELECT id FROM workers ORDER BY joined, id"))
+            if members == self.__members:
+                return
+            logger.info("rebalancing shards - {} worker(s): {}".format(len(members), ", ".join(members)))
+            self.__ring = HashRing(members, config.Sharding.replicas)
+            self.__members = members
+            self.generation += 1
+        for listener in self.__listeners:
+            try:
+                listener()
+            except Exception as ex:
+                logger.error("rebalance listener failed - {}".format(ex))
+
+    def owns(self, device_id: str) -> bool:
+        return self.__ring.owner(device_id) == self.worker_id
+
+    def setConnected(self, device_id: str, connected: bool) -> None:
+        """Track devices this worker connected to the hub, so a rebalance can release all of them."""
+        with self.__lock:
+            if connected:
+                self.__connected.add(device_id)
+            else:
+                self.__connected.discard(device_id)
+
+    @property
+    def connected(self) -> set:
+        with self.__lock:
+            return set(self.__connected)
+
+    @property
+    def is_leader(self) -> bool:
+        members = self.__members
+        return bool(members) and members[0] == self.worker_id
+
+    @property
+    def members(self) -> tuple:
+        return self.__members
+
+    def leave(self) -> None:
+        self.__stop.set()
+        with self.__lock:
+            with self.__conn:
+                self.__conn.execute("DELETE FROM workers WHERE id=(?)", (self.worker_id, ))
+
+    def run(self):
+        while not self.__stop.wait(config.Sharding.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as ex:
+                logger.error("heartbeat failed - {}".format(ex))
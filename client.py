@@ -15,16 +15,10 @@
 """
 
 
-from blebox import Monitor, root_logger, DeviceManager, config
-from requests import get, exceptions
+from blebox import Monitor, root_logger, DeviceManager, ReadingPoller, DeadbandFilter, WindowAggregator, Outbox, EventEmitter, ReachabilityTracker, ShardCoordinator, MetricsServer, metrics, profiler, http_pool, circuit_breaker, device_type_map, config
 from time import sleep
-import json, time, random, cc_lib
-
-
-if config.RuntimeEnv.max_start_delay > 0:
-    delay = random.randint(1, config.RuntimeEnv.max_start_delay)
-    print("delaying start for {}s".format(delay))
-    time.sleep(delay)
+from threading import Thread, Event
+import time, random, atexit, signal, cc_lib
 
 
 logger = root_logger.getChild(__name__)
@@ -32,46 +26,168 @@ logger = root_logger.getChild(__name__)
 
 device_manager = DeviceManager()
 
+shard = ShardCoordinator() if config.Sharding.enabled else None
+
+outbox = Outbox("outbox-{}".format(shard.worker_id) if shard else "outbox")
+atexit.register(outbox.flush)
+
+if shard:
+    atexit.register(shard.leave)
+
+hub_connected = Event()
+hub_connected_at = 0.0
+
 
 def on_connect(client: cc_lib.client.Client):
+    global hub_connected_at
+    hub_connected_at = time.monotonic()
+    hub_connected.set()
     devices = device_manager.devices
     for device in devices.values():
         try:
-            if device.reachable:
+            if device.reachable and (shard is None or shard.owns(device.id)):
                 client.connectDevice(device, asynchronous=True)
+                if shard:
+                    shard.setConnected(device.id, True)
         except cc_lib.client.DeviceConnectError:
             pass
+    if len(outbox):
+        Thread(target=outbox.replay, args=(emitEvent, ), name="outboxReplay", daemon=True).start()
+
+
+def on_disconnect(client: cc_lib.client.Client):
+    hub_connected.clear()
+    if shard:
+        if time.monotonic() - hub_connected_at < config.Sharding.heartbeat_timeout:
+            # workers share the hub identity, a broker rejecting concurrent sessions makes them take over each other's
+            logger.warning("hub connection lost shortly after connecting - check that the broker accepts a connection per worker")
+        for device_id in shard.connected:
+            shard.setConnected(device_id, False)
 
 
 client_connector = cc_lib.client.Client()
 client_connector.setConnectClbk(on_connect)
+client_connector.setDisconnectClbk(on_disconnect)
+
 
-device_monitor = Monitor(device_manager, client_connector)
+def on_rebalance():
+    if not hub_connected.is_set():
+        return
+    devices = device_manager.devices
+    owned = {device_id for device_id in devices if shard.owns(device_id)}
+    connected = shard.connected
+    for device_id in connected - owned:
+        client_connector.disconnectDevice(device_id, asynchronous=True)
+        shard.setConnected(device_id, False)
+    for device_id in owned - connected:
+        if devices[device_id].reachable:
+            client_connector.connectDevice(devices[device_id], asynchronous=True)
+            shard.setConnected(device_id, True)
+
+
+def rebalance() -> bool:
+    try:
+        on_rebalance()
+        return True
+    except Exception as ex:
+        logger.error("rebalance failed - {}".format(ex))
+        return False
+
+
+reachability = ReachabilityTracker()
+
+device_monitor = Monitor(device_manager, client_connector, reachability, shard)
+
+
+reading_filter = DeadbandFilter(
+    (service.local_id for d_type in device_type_map.values() for service in d_type.services),
+    absolute=config.Reporting.absolute_deadband,
+    relative=config.Reporting.relative_deadband,
+    heartbeat=config.Reporting.heartbeat_interval
+)
+
+
+reading_aggregator = WindowAggregator(
+    (service.local_id for d_type in device_type_map.values() for service in d_type.services),
+    window=config.Aggregation.window,
+    capacity=config.Aggregation.capacity,
+    value=config.Aggregation.value
+) if config.Aggregation.enabled else None
+
+
+def emitEvent(device_id, service, data):
+    return client_connector.emmitEvent(
+        cc_lib.client.message.EventEnvelope(device_id, service, cc_lib.client.message.Message(data)),
+        asynchronous=True
+    )
+
+
+event_emitter = EventEmitter(
+    emitEvent,
+    outbox.put,
+    max_size=config.Emission.max_size,
+    policy=config.Emission.policy,
+    max_in_flight=config.Emission.max_in_flight
+)
+
+
+def emitReadings(device, air_state):
+    readings = [("reading_{}".format(sensor['type']), sensor['value'], None) for sensor in air_state['air']['sensors']]
+    if reading_aggregator:
+        for service, value, _ in readings:
+            reading_aggregator.add(device.id, service, value)
+        readings = [
+            (service, aggregates[reading_aggregator.value], aggregates) for service, aggregates in reading_aggregator.collect(device.id).items()
+        ]
+    if config.Reporting.change_only:
+        readings = [reading for reading in readings if reading_filter.accept(device.id, reading[0], reading[1])]
+    for service, data in device.encodeReadings(readings):
+        if hub_connected.is_set():
+            event_emitter.put(device.id, service, data)
+        else:
+            outbox.put(device.id, service, data)
+
+
+reading_poller = ReadingPoller(device_manager, emitReadings, reachability, shard)
+
+
+metrics.addGauge("blebox_devices", "Devices in the device pool.", lambda: len(device_manager.devices))
+metrics.addGauge("blebox_emission_queue_depth", "Events waiting for emission.", lambda: event_emitter.depth)
+metrics.addGauge("blebox_emission_in_flight", "Emitted events awaiting acknowledgement.", lambda: event_emitter.in_flight)
+metrics.addGauge("blebox_emission_latency_seconds", "Moving average of enqueue-to-ack latency.", lambda: event_emitter.latency)
+metrics.addGauge("blebox_outbox_size", "Events stored in the outbox.", lambda: len(outbox))
+metrics.addGauge("blebox_open_circuits", "Hosts whose circuit breaker is open or half-open.", lambda: len(circuit_breaker))
+metrics.addGauge("blebox_http_connection_reuse_ratio", "Share of device requests sent over reused connections.", lambda: http_pool.reuse_ratio)
+
+
+def replayOutbox():
+    # events that failed while the hub stayed connected are replayed once emissions succeed again
+    failed = event_emitter.failed
+    while True:
+        time.sleep(config.Outbox.replay_interval)
+        if hub_connected.is_set() and len(outbox) and event_emitter.failed == failed:
+            outbox.replay(emitEvent)
+        failed = event_emitter.failed
 
 
 def pushReadings():
-    msg = cc_lib.client.message.Message(str())
-    while True:
-        for device in device_manager.devices.values():
-            if device.reachable:
-                try:
-                    response = get(url="http://{}/{}".format(device.ip, config.Api.air_sensor_state))
-                    if response.status_code == 200:
-                        air_state = response.json()
-                        for sensor in air_state['air']['sensors']:
-                            msg.data = json.dumps(device.getService("reading_{}".format(sensor['type']), sensor['value']))
-                            client_connector.emmitEvent(
-                                cc_lib.client.message.EventEnvelope(device, "reading_{}".format(sensor['type']), msg),
-                                asynchronous=True
-                            )
-                except exceptions.RequestException:
-                    logger.error("could not send request to '{}'".format(device.ip))
-                except Exception as ex:
-                    logger.error(ex)
-        time.sleep(300)
+    reading_poller.run()
 
 
 if __name__ == '__main__':
+    profiler.installSignalHandler()
+    signal.signal(signal.SIGUSR2, lambda *args: device_monitor.requestSweep())
+    if config.Profiling.enabled:
+        profiler.start()
+    if config.Metrics.port > 0:
+        MetricsServer().start()
+    event_emitter.start()
+    Thread(target=pushReadings, name="pushReadings", daemon=True).start()
+    Thread(target=replayOutbox, name="outboxReplayTimer", daemon=True).start()
+    if config.RuntimeEnv.max_start_delay > 0:
+        delay = random.randint(1, config.RuntimeEnv.max_start_delay)
+        print("delaying hub connection for {}s".format(delay))
+        time.sleep(delay)
     while True:
         try:
             client_connector.initHub()
@@ -79,5 +195,18 @@ if __name__ == '__main__':
         except cc_lib.client.HubInitializationError:
             sleep(10)
     client_connector.connect(reconnect=True)
+    if shard:
+        # followers pick up devices discovered by the leader until they become leader themselves
+        shard.addListener(on_rebalance)
+        pending = not rebalance()
+        shard.start()
+        while not shard.is_leader:
+            try:
+                pending |= device_manager.reload()
+            except Exception as ex:
+                logger.error("could not reload devices - {}".format(ex))
+            if pending:
+                pending = not rebalance()
+            time.sleep(config.Sharding.heartbeat_interval)
     device_monitor.start()
-    pushReadings()
+    device_monitor.join()